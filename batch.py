@@ -0,0 +1,179 @@
+"""
+
+Brandon Dunbar
+Batch Generator
+Generates reports for many DNA files at once across a process pool
+
+Usage: python batch.py <DNA files or directories> -o <output folder>
+
+"""
+
+import argparse
+import csv
+import os
+import time
+
+import file_parser
+import generate_pdf
+import group_mngr
+import logger
+import workers
+from logger import log
+
+MANIFEST_NAME = "manifest.csv"
+
+def _report_names(dna_paths):
+    """
+    Names each report after its DNA file, numbering repeats so files with
+    the same name in different directories don't overwrite each other
+
+    :param dna_paths:
+    List of DNA file paths
+    :return:
+    A list of report names, in the same order
+    """
+
+    names = []
+    seen = {}
+
+    for dna_path in dna_paths:
+        name = file_parser.base_name(dna_path)
+
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}_{seen[name]}"
+        else:
+            seen[name] = 0
+
+        names.append(name)
+
+    return names
+
+
+def _generate_one(job):
+    """
+    Generates a single report in a worker process
+
+    :param job:
+    (dna_path, filename, output_path, header, use_cache, progress_logs,
+    export_path)
+    :return:
+    A manifest row: [dna_path, report path, status, error, seconds]
+    """
+
+    (dna_path, filename, output_path, header, use_cache, progress_logs,
+     export_path) = job
+    start = time.perf_counter()
+
+    if progress_logs:
+        progress_log = os.path.join(output_path, f"{filename}.progress.jsonl")
+    else:
+        progress_log = None
+
+    try:
+        report = generate_pdf.generate(dna_path, header, filename,
+                                       output_path, groups=workers.shared(),
+                                       use_cache=use_cache,
+                                       progress_log=progress_log,
+                                       export_path=export_path)
+        status, error = "success", ""
+
+    except Exception as exception:  # One bad file mustn't stop the batch
+        report, status, error = "", "failure", repr(exception)
+
+    seconds = round(time.perf_counter() - start, 3)
+
+    # Pool workers exit without running exit handlers, write the logs now
+    logger.flush()
+
+    return [dna_path, report, status, error, seconds]
+
+
+def generate_batch(dna_paths, output_path, header="", processes=None,
+                   groups=None, use_cache=False, progress_logs=False,
+                   export_path=None):
+    """
+    Generates a report for every DNA file, spread over a process pool, and
+    writes a manifest of each file's outcome to the output folder
+
+    :param dna_paths:
+    DNA file paths and directories holding DNA files
+    :param output_path:
+    Destination for the reports and manifest
+    :param header:
+    Paragraph at the top of every report
+    :param processes:
+    Number of worker processes, defaults to the number of CPUs
+    :param groups:
+    The groups to report on, loaded once from disk if not given
+    :param use_cache:
+    Index each DNA file in the genotype cache. Off by default since batch
+    files are usually seen once.
+    :param progress_logs:
+    Write each report's progress events to <report>.progress.jsonl in the
+    output folder
+    :param export_path:
+    Optional dataset file every report's genotypes and results are
+    appended to, see export.py
+    :return:
+    The manifest rows: [dna_path, report path, status, error, seconds]
+    """
+
+    if groups is None:
+        groups = group_mngr.load_groups()
+
+    dna_paths = workers.collect_dna_files(dna_paths)
+    jobs = [(dna_path, filename, output_path, header, use_cache,
+             progress_logs, export_path)
+            for dna_path, filename in zip(dna_paths,
+                                          _report_names(dna_paths))]
+
+    os.makedirs(output_path, exist_ok=True)
+
+    # The groups are sent to each worker once, not with every file
+    with workers.make_pool(processes, groups) as pool:
+        results = list(pool.imap_unordered(_generate_one, jobs))
+
+    results.sort()  # Back into file order
+
+    with open(os.path.join(output_path, MANIFEST_NAME), "w",
+              newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(["dna_path", "report", "status", "error", "seconds"])
+        writer.writerows(results)
+
+    failures = sum(1 for result in results if result[2] == "failure")
+    log(f"Batch of {len(results)} reports created in {output_path}, "
+        f"{failures} failed.")
+
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate reports for many "
+                                                 "DNA files")
+    parser.add_argument("paths", nargs="+",
+                        help="DNA files or directories of DNA files")
+    parser.add_argument("-o", "--output", required=True,
+                        help="Folder to write the reports and manifest to")
+    parser.add_argument("--header", default="",
+                        help="Paragraph at the top of every report")
+    parser.add_argument("-p", "--processes", type=int, default=None,
+                        help="Worker processes, defaults to the CPU count")
+    parser.add_argument("--cache", action="store_true",
+                        help="Index each DNA file in the genotype cache")
+    parser.add_argument("--progress-logs", action="store_true",
+                        help="Write each report's progress events as JSON "
+                             "lines next to it")
+    parser.add_argument("--export", default=None,
+                        help="Dataset file to append every report's "
+                             "genotypes and results to")
+    args = parser.parse_args()
+
+    batch = generate_batch(args.paths, args.output, args.header,
+                           args.processes, use_cache=args.cache,
+                           progress_logs=args.progress_logs,
+                           export_path=args.export)
+
+    for row in batch:
+        print(f"{row[2]}: {row[0]} {row[1] or row[3]}")
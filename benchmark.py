@@ -0,0 +1,639 @@
+"""
+
+Brandon Dunbar
+Benchmarks
+Timing scripts for the report pipeline, run with: python benchmark.py <name>
+
+"""
+
+import argparse
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+import file_parser
+from gene import Gene
+from tests.helpers import BASES, working_directory, write_dna_file
+
+
+def _random_genotype(i):
+    """
+    Random alleles, so nothing can be predicted from the row number
+    """
+
+    return random.choice(BASES), random.choice(BASES)
+
+
+def _write_dna_file(path, lines, service="AncestryDNA"):
+    """
+    Writes a synthetic raw DNA file with rs ids rs1 through rs<lines> and
+    random genotypes, see tests.helpers.write_dna_file
+    """
+
+    write_dna_file(path, lines, service, genotype=_random_genotype)
+
+
+def _make_groups(size, lines):
+    """
+    Makes a single group of genes with rs ids spread over the DNA file
+
+    :param size:
+    Number of genes in the group
+    :param lines:
+    Number of rows in the DNA file the rs ids are drawn from
+    :return:
+    Group dictionary
+    """
+
+    genes = []
+    for rs_number in random.sample(range(1, lines + 1), size):
+        genes.append(Gene([f"Gene{rs_number}", f"rs{rs_number}", "A", "G",
+                           "A", "G", "Red note", "Yellow note",
+                           "Green note"]))
+
+    return {"Benchmark": genes}
+
+
+def _best_of(function, repeat=3):
+    """
+    Times a function and returns the fastest of several runs in seconds
+    """
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    return min(times)
+
+
+def bench_parse(lines):
+    """
+    Parse time as the panel grows from 10 to 10,000 rs ids
+
+    :param lines:
+    Number of rows in the synthetic DNA file
+    """
+
+    with tempfile.TemporaryDirectory() as directory:
+        dna_path = os.path.join(directory, "dna.txt")
+        _write_dna_file(dna_path, lines)
+
+        print(f"parse, {lines} lines")
+        for size in (10, 100, 1000, 10000):
+            groups = _make_groups(size, lines)
+            lookup = file_parser.build_lookup(groups)
+
+            for backend in ("stream", "mmap"):
+                seconds = _best_of(lambda: file_parser.parse(groups,
+                                                             dna_path,
+                                                             "AncestryDNA",
+                                                             lookup,
+                                                             backend=backend))
+                print(f"  {size:>6} rs ids, {backend:>6}: {seconds:.3f}s")
+
+
+def bench_early_exit(lines):
+    """
+    Savings from stopping the scan once every rs id is found, for a 40 gene
+    panel that sits in the first tenth of the file
+
+    :param lines:
+    Number of rows in the synthetic DNA file
+    """
+
+    print(f"early exit, {lines} lines")
+    for service in ("AncestryDNA", "23&Me"):
+
+        with tempfile.TemporaryDirectory() as directory:
+            dna_path = os.path.join(directory, "dna.txt")
+            _write_dna_file(dna_path, lines, service)
+
+            groups = _make_groups(40, lines // 10)
+            stats = {}
+
+            seconds = _best_of(lambda: file_parser.parse(groups, dna_path,
+                                                         service,
+                                                         stats=stats))
+            print(f"  {service:>11}: {seconds:.3f}s, "
+                  f"read {stats['lines_read']} lines / "
+                  f"{stats['bytes_read']} bytes, "
+                  f"skipped ~{stats['lines_skipped']} lines / "
+                  f"{stats['bytes_skipped']} bytes")
+
+
+def bench_parse_many(lines):
+    """
+    Pulling genes for several report variants, a parse per variant against
+    one parse_many scan. Each variant's panel is spread over the whole file
+    so no scan can stop early.
+
+    :param lines:
+    Number of rows in the synthetic DNA file
+    """
+
+    with tempfile.TemporaryDirectory() as directory:
+        dna_path = os.path.join(directory, "dna.txt")
+        _write_dna_file(dna_path, lines)
+
+        print(f"parse_many, {lines} lines")
+        for variants in (2, 4, 8):
+            group_sets = {f"Variant{i}": _make_groups(200, lines)
+                          for i in range(variants)}
+
+            def separate():
+                return [file_parser.parse(groups, dna_path, "AncestryDNA")
+                        for groups in group_sets.values()]
+
+            def single():
+                return file_parser.parse_many(group_sets, dna_path,
+                                              "AncestryDNA")
+
+            print(f"  {variants} variants: separate {_best_of(separate):.3f}s,"
+                  f" one scan {_best_of(single):.3f}s")
+
+
+def _pull(path):
+    """
+    The parser's original text generator, kept as the tokenizer baseline.
+    Every line is decoded and split before its RS id is checked.
+
+    :param path:
+    Path of the plain DNA file
+    :return:
+    A generator of the file's rows as lists
+    """
+
+    with open(path, "r") as file:
+
+        for line in file:
+
+            if not line.startswith("#"):
+
+                yield [i.strip() for i in line.split("\t")]
+
+
+def bench_tokenizer(lines):
+    """
+    The binary tokenizer against the original text generator, with every
+    line scanned (the wanted rs ids aren't in the file)
+
+    :param lines:
+    Number of rows in the synthetic DNA file
+    """
+
+    with tempfile.TemporaryDirectory() as directory:
+        dna_path = os.path.join(directory, "dna.txt")
+        _write_dna_file(dna_path, lines)
+
+        wanted = frozenset(f"rs{lines + i}" for i in range(1, 41))
+
+        def text():
+            return [row for row in _pull(dna_path)
+                    if row[0] in wanted]
+
+        def binary():
+            with file_parser.DnaFile(dna_path) as dna_file:
+                return list(file_parser._stream(dna_file, wanted))
+
+        print(f"tokenizer, {lines} lines")
+        print(f"  text generator: {_best_of(text):.3f}s")
+        print(f"  binary prefix:  {_best_of(binary):.3f}s")
+
+
+def _compress(path, compression):
+    """
+    Writes a compressed copy of a DNA file next to it
+
+    :param path:
+    The plain DNA file
+    :param compression:
+    "gzip", "bz2" or "zip"
+    :return:
+    Path of the copy
+    """
+
+    import bz2
+    import gzip
+    import shutil
+    import zipfile
+
+    if compression == "zip":
+        with zipfile.ZipFile(f"{path}.zip", "w",
+                             zipfile.ZIP_DEFLATED) as archive:
+            archive.write(path, os.path.basename(path))
+
+        return f"{path}.zip"
+
+    opener = gzip.open if compression == "gzip" else bz2.open
+    extension = ".gz" if compression == "gzip" else ".bz2"
+
+    with open(path, "rb") as source, opener(path + extension, "wb") as copy:
+        shutil.copyfileobj(source, copy)
+
+    return path + extension
+
+
+def bench_compressed(lines):
+    """
+    Full scan throughput of plain, gzip, bz2 and zip DNA files, in MB of
+    uncompressed data per second. The wanted rs ids aren't in the file so
+    every line is read.
+
+    :param lines:
+    Number of rows in the synthetic DNA file
+    """
+
+    with tempfile.TemporaryDirectory() as directory:
+        dna_path = os.path.join(directory, "dna.txt")
+        _write_dna_file(dna_path, lines)
+
+        megabytes = os.path.getsize(dna_path) / 10 ** 6
+        wanted = frozenset(f"rs{lines + i}" for i in range(1, 41))
+
+        print(f"compressed input, {lines} lines ({megabytes:.1f} MB)")
+        for compression in (None, "gzip", "bz2", "zip"):
+            path = dna_path if compression is None else \
+                _compress(dna_path, compression)
+
+            def scan():
+                with file_parser.DnaFile(path) as dna_file:
+                    return list(file_parser._stream(dna_file, wanted))
+
+            seconds = _best_of(scan)
+            size = os.path.getsize(path) / 10 ** 6
+
+            print(f"  {compression or 'plain':>5}: {megabytes / seconds:6.1f}"
+                  f" MB/s ({size:.1f} MB on disk)")
+
+
+def bench_cache(lines):
+    """
+    Parse with the genotype cache, first run (full scan and index) against
+    later runs (index lookups)
+
+    :param lines:
+    Number of rows in the synthetic DNA file
+    """
+
+    with working_directory():
+        _write_dna_file("dna.txt", lines)
+        groups = _make_groups(min(2000, lines), lines)
+
+        start = time.perf_counter()
+        file_parser.parse(groups, "dna.txt", "AncestryDNA",
+                          use_cache=True)
+        first = time.perf_counter() - start
+
+        hit = _best_of(lambda: file_parser.parse(groups, "dna.txt",
+                                                 "AncestryDNA",
+                                                 use_cache=True))
+
+    print(f"genotype cache, {lines} lines")
+    print(f"  first parse: {first:.3f}s")
+    print(f"  cache hit:   {hit * 1000:.1f}ms")
+
+
+def bench_regions(lines):
+    """
+    Region queries of 100 kb, scanning the whole file for them against
+    seeking with the region index
+
+    :param lines:
+    Number of rows in the synthetic DNA file
+    """
+
+    import region_index
+
+    with working_directory():
+        _write_dna_file("dna.txt", lines)
+
+        # Positions run from 100 to lines * 100 over chromosomes 1-22
+        chromosome_rows = lines // 22
+        regions = [(str(chromosome), start, start + 100000)
+                   for chromosome in (1, 7, 19)
+                   for start in [(chromosome - 1) * chromosome_rows * 100
+                                 + chromosome_rows * 50]]
+
+        def scan():
+            region_index.clear()
+            return file_parser.parse_regions("dna.txt", regions)
+
+        seconds = _best_of(scan)
+        indexed = _best_of(lambda: file_parser.parse_regions("dna.txt",
+                                                             regions))
+
+    print(f"regions, {lines} lines")
+    print(f"  full scan (and index): {seconds:.3f}s")
+    print(f"  indexed:               {indexed * 1000:.1f}ms")
+
+
+def _pulled_genes(groups):
+    """
+    Genotypes for every gene in the groups, as parse() would return them
+    """
+
+    return {gene.rs_id: ["1", "100", "A", "G"]
+            for genes in groups.values() for gene in genes}
+
+
+def bench_format_group(lines):
+    """
+    format_group throughput, against the stylesheet per gene it used to
+    build
+
+    :param lines:
+    Unused, format_group doesn't read the DNA file
+    """
+
+    # Imported here so the parse benchmarks run without ReportLab
+    from reportlab.lib.styles import getSampleStyleSheet
+    import generate_pdf
+
+    print("format_group")
+    for size in (100, 2000):
+        groups = _make_groups(size, size)
+        genes = groups["Benchmark"]
+        pulled_genes = _pulled_genes(groups)
+
+        seconds = _best_of(lambda: generate_pdf.format_group(genes,
+                                                             "AncestryDNA",
+                                                             pulled_genes))
+        per_gene = _best_of(lambda: [getSampleStyleSheet()
+                                     for _ in range(size)])
+
+        print(f"  {size:>5} genes: {size / seconds:,.0f} genes/s, "
+              f"a stylesheet per gene added {per_gene:.3f}s")
+
+
+def bench_table_style(lines):
+    """
+    Group table layout time against group size, styling every highlighted
+    cell with its own setStyle call against one combined TableStyle
+
+    :param lines:
+    Unused, the tables don't read the DNA file
+    """
+
+    from reportlab.platypus import Table, TableStyle
+    from reportlab.lib import colors
+    import generate_pdf
+
+    legend = [("Gene", "RS#", "Wild/Var", "Result",), ]
+
+    def per_cell(formatted_group, gene_notes):
+        table = Table(data=tuple(legend + formatted_group),
+                      colWidths=(75, 60, 50, 275,), rowHeights=20)
+        for cell_color, cells in zip(generate_pdf.RESULT_COLORS, gene_notes):
+            for cell in cells:
+                table.setStyle(TableStyle([('BACKGROUND', cell, cell,
+                                            cell_color),
+                                           ('TEXTCOLOR', cell, cell,
+                                            colors.black)]))
+        table.wrap(460, 100000)
+
+    def combined(formatted_group, gene_notes):
+        table = Table(data=tuple(legend + formatted_group),
+                      colWidths=(75, 60, 50, 275,), rowHeights=20,
+                      style=generate_pdf._table_style(gene_notes))
+        table.wrap(460, 100000)
+
+    print("table style")
+    for size in (10, 100, 500, 2000):
+        groups = _make_groups(size, size)
+        formatted_group, gene_notes = generate_pdf.format_group(
+            groups["Benchmark"], "AncestryDNA", _pulled_genes(groups))
+
+        before = _best_of(lambda: per_cell(formatted_group, gene_notes))
+        after = _best_of(lambda: combined(formatted_group, gene_notes))
+
+        print(f"  {size:>5} genes: per cell {before:.3f}s, "
+              f"combined {after:.3f}s")
+
+
+def _render_report(size, stream):
+    """
+    Writes a report for a one group panel, in a fresh process so its peak
+    RSS belongs to this report alone
+
+    :param size:
+    Number of genes in the group
+    :param stream:
+    Passed to write_report
+    :return:
+    (seconds, peak RSS in KiB)
+    """
+
+    import resource  # Unix only
+    from PIL import Image
+
+    with working_directory() as directory:
+        os.makedirs("PersistentData")
+        Image.new("RGB", (64, 64)).save("PersistentData/eg.jpg")
+
+        import generate_pdf
+
+        groups = _make_groups(size, size)
+        pulled_genes = _pulled_genes(groups)
+
+        start = time.perf_counter()
+        generate_pdf.write_report(groups, pulled_genes, "report",
+                                  directory, "AncestryDNA", "",
+                                  stream=stream)
+        seconds = time.perf_counter() - start
+
+    return seconds, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def bench_render(lines):
+    """
+    Report build time and peak RSS as the panel grows, building every
+    flowable up front against streaming them into the build
+
+    :param lines:
+    Unused, the report doesn't read the DNA file
+    """
+
+    context = multiprocessing.get_context("spawn")
+
+    print("render")
+    for size in (1000, 10000, 50000):
+        for stream in (False, True):
+            with context.Pool(1) as pool:
+                seconds, peak = pool.apply(_render_report, (size, stream))
+
+            mode = "stream" if stream else "list"
+            print(f"  {size:>6} genes, {mode:>6}: {seconds:.2f}s, "
+                  f"peak RSS {peak / 1024:.0f} MiB")
+
+
+def bench_templates(lines):
+    """
+    Time per small report in a batch, with the logo, title and header
+    prepared once against rebuilt for every report
+
+    :param lines:
+    Unused, the reports don't read the DNA file
+    """
+
+    from PIL import Image
+
+    print("report templates")
+    with working_directory() as directory:
+        os.makedirs("PersistentData")
+        Image.effect_noise((600, 600), 64).convert("RGB").save(
+            "PersistentData/eg.jpg")
+
+        import generate_pdf
+
+        groups = _make_groups(20, 20)
+        pulled_genes = _pulled_genes(groups)
+
+        def report():
+            generate_pdf.write_report(groups, pulled_genes, "report",
+                                      directory, "AncestryDNA",
+                                      "Header " * 50)
+
+        def uncached():
+            generate_pdf._templates.clear()
+            report()
+
+        print(f"  rebuilt: {_best_of(uncached, 20) * 1000:.1f}ms")
+        print(f"  cached:  {_best_of(report, 20) * 1000:.1f}ms")
+
+
+class _DictGene:
+    """Gene as it was before __slots__, for the memory benchmark"""
+
+    def __init__(self, attributes):
+        (self.name, self.rs_id, self.tt_wild, self.tt_var, self.anc_wild,
+         self.anc_var, self.red_notes, self.yellow_notes,
+         self.green_notes) = attributes
+
+
+def bench_gene_memory(lines):
+    """
+    Memory held by 10k and 100k genes, before and after __slots__ and
+    shared strings. Every gene's attributes are fresh strings, as they are
+    when read from the GUI or unpickled, with notes drawn from 50 texts.
+
+    :param lines:
+    Unused, no DNA file is read
+    """
+
+    notes = [f"Note {i}: " + "lorem ipsum dolor sit amet " * 8
+             for i in range(50)]
+
+    def note():
+        return (random.choice(notes) + " ")[:-1]  # A new copy of the text
+
+    def attributes(i):
+        return [f"Gene{i}", f"rs{i}", "A", "G", "C", "T",
+                note(), note(), note()]
+
+    print("gene memory")
+    for size in (10000, 100000):
+        for name, cls in (("dict", _DictGene), ("slots", Gene)):
+            tracemalloc.start()
+            genes = [cls(attributes(i)) for i in range(size)]
+            held = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            del genes
+
+            print(f"  {size:>6} genes, {name:>5}: {held / 2 ** 20:.1f} MiB")
+
+
+def bench_group_edit(lines):
+    """
+    Latency of saving a one gene edit as the panel grows, rewriting the
+    whole pickle against updating the gene in the group database
+
+    :param lines:
+    Unused, no DNA file is read
+    """
+
+    import _pickle as pickle
+
+    print("group edit")
+    with working_directory():
+        import group_mngr
+        group_mngr._make_paths()
+
+        for size in (100, 1000, 10000, 100000):
+            groups = _make_groups(size, size)
+            group_mngr.save_groups(groups)
+            gene = groups["Benchmark"][size // 2]
+
+            def rewrite():
+                with open("groups.pickle", "wb") as file_object:
+                    pickle.dump(groups, file_object)
+
+            def update():
+                group_mngr.update_gene("Benchmark", gene.name, gene)
+
+            print(f"  {size:>6} genes: "
+                  f"pickle {_best_of(rewrite) * 1000:.2f}ms, "
+                  f"update {_best_of(update) * 1000:.2f}ms")
+
+
+def bench_cohort(lines):
+    """
+    Cohort counting time as worker processes are added, over a folder of
+    DNA files
+
+    :param lines:
+    Number of rows in each synthetic DNA file
+    """
+
+    import cohort
+
+    files = 32
+
+    with tempfile.TemporaryDirectory() as directory:
+        for i in range(files):
+            service = "AncestryDNA" if i % 2 else "23&Me"
+            _write_dna_file(os.path.join(directory, f"dna{i}.txt"), lines,
+                            service)
+
+        groups = _make_groups(1000, lines)
+
+        print(f"cohort, {files} files of {lines} lines")
+        for processes in sorted({1, 2, 4, os.cpu_count() or 1}):
+
+            def run():
+                cohort.run_cohort([directory], groups, processes)
+
+            print(f"  {processes:>2} processes: "
+                  f"{_best_of(run, repeat=1):.2f}s")
+
+
+BENCHMARKS = {"parse": bench_parse,
+              "early_exit": bench_early_exit,
+              "parse_many": bench_parse_many,
+              "tokenizer": bench_tokenizer,
+              "compressed": bench_compressed,
+              "cache": bench_cache,
+              "regions": bench_regions,
+              "cohort": bench_cohort,
+              "format_group": bench_format_group,
+              "table_style": bench_table_style,
+              "render": bench_render,
+              "templates": bench_templates,
+              "gene_memory": bench_gene_memory,
+              "group_edit": bench_group_edit}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run pipeline benchmarks")
+    parser.add_argument("names", nargs="*", default=list(BENCHMARKS),
+                        help="Benchmarks to run: " + ", ".join(BENCHMARKS))
+    parser.add_argument("--lines", type=int, default=700000,
+                        help="Rows in the synthetic DNA file")
+    args = parser.parse_args()
+
+    for name in args.names:
+        BENCHMARKS[name](args.lines)
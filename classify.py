@@ -0,0 +1,155 @@
+"""
+
+Brandon Dunbar
+Classifier
+Sorts genes into not found, green, red and yellow results for a whole panel
+at once
+
+"""
+
+from array import array
+from operator import attrgetter
+
+import formats
+
+try:
+    import numpy
+except ImportError:  # Optional, falls back to a plain Python pass
+    numpy = None
+
+# Result codes
+NOT_FOUND = 0
+GREEN = 1
+RED = 2
+YELLOW = 3
+
+RESULT_NAMES = ("Not found", "Green", "Red", "Yellow")
+
+
+def _columns(genes, service, pulled_genes):
+    """
+    Splits the panel and its pulled genotypes into columns
+
+    :param genes:
+    A list of gene objects
+    :param service:
+    AncestryDNA or 23&me
+    :param pulled_genes:
+    The genes pulled from the DNA file
+    :return:
+    (found, allele one, allele two, wild, variant) lists, upper cased
+    """
+
+    # Get the target service's columns
+    vendor = formats.get(service)
+    get_wild = attrgetter(vendor.wild)
+    get_variant = attrgetter(vendor.variant)
+
+    wild = [get_wild(gene).upper() for gene in genes]
+    variant = [get_variant(gene).upper() for gene in genes]
+
+    pulled = [pulled_genes.get(gene.rs_id) for gene in genes]
+    found = [pulled_gene is not None for pulled_gene in pulled]
+    one = [pulled_gene[2].upper() if pulled_gene else ""
+           for pulled_gene in pulled]
+    two = [pulled_gene[3].upper() if pulled_gene else ""
+           for pulled_gene in pulled]
+
+    return found, one, two, wild, variant
+
+
+def _classify_numpy(found, one, two, wild, variant):
+    """
+    Compares the columns as NumPy arrays, in one vectorized pass
+    """
+
+    found = numpy.array(found, dtype=bool)
+    one, two, wild, variant = (numpy.array(column, dtype=str)
+                               for column in (one, two, wild, variant))
+
+    results = numpy.full(len(found), YELLOW, dtype=numpy.int8)
+
+    # Later assignments take priority
+    results[(one == variant) & (two == variant)] = RED
+    results[(one == wild) & (two == wild)] = GREEN
+    results[~found] = NOT_FOUND
+
+    # Handed back as plain Python codes, NumPy's int8 scalars would keep
+    # arithmetic on them in int8 and overflow
+    return array("b", results.tobytes())
+
+
+def _classify_python(found, one, two, wild, variant):
+    """
+    Compares the columns one gene at a time, when NumPy isn't installed
+    """
+
+    results = array("b")
+
+    for is_found, allele_one, allele_two, _wild, _variant in \
+            zip(found, one, two, wild, variant):
+
+        if not is_found:
+            results.append(NOT_FOUND)
+        elif allele_one == _wild and allele_two == _wild:
+            results.append(GREEN)
+        elif allele_one == _variant and allele_two == _variant:
+            results.append(RED)
+        else:
+            results.append(YELLOW)
+
+    return results
+
+
+def classify(genes, service, pulled_genes):
+    """
+    Classifies every gene in a panel
+
+    Green - both alleles are the wild type
+    Red - both alleles are the variant
+    Yellow - anything else
+    Not found - the RS id isn't in the DNA file
+
+    :param genes:
+    A list of gene objects
+    :param service:
+    AncestryDNA or 23&me
+    :param pulled_genes:
+    The genes pulled from the DNA file
+    :return:
+    An array("b") of result codes, one per gene, with or without NumPy
+    """
+
+    columns = _columns(genes, service, pulled_genes)
+
+    if numpy is not None:
+        return _classify_numpy(*columns)
+
+    return _classify_python(*columns)
+
+
+def classify_groups(groups, service, pulled_genes):
+    """
+    Classifies every gene of every group in a single pass
+
+    :param groups:
+    The dictionary of groups and their gene objects
+    :param service:
+    AncestryDNA or 23&me
+    :param pulled_genes:
+    The genes pulled from the DNA file
+    :return:
+    {'Group Name': array("b") of result codes, } in the same order as each
+    group's genes
+    """
+
+    panel = [gene for genes in groups.values() for gene in genes]
+    results = classify(panel, service, pulled_genes)
+
+    grouped = {}
+    start = 0
+    for group, genes in groups.items():
+        grouped[group] = results[start:start + len(genes)]
+        start += len(genes)
+
+    return grouped
@@ -0,0 +1,119 @@
+"""
+
+Brandon Dunbar
+Command Line
+Generates a single report without the GUI. Kivy is never imported, so it
+starts quickly and runs without a display (cron jobs, worker containers).
+
+Usage: python cli.py <DNA file> -o <output folder> [-n <report name>]
+
+Several reports on different groups can be made from one scan of the file
+with --variant, e.g. --variant heart=Cardio,Lipids --variant full=Cardio,
+Lipids,Vitamins makes <report name>-heart.pdf and <report name>-full.pdf.
+
+For many files at once see batch.py.
+
+"""
+
+import argparse
+import os
+import sys
+
+import file_parser
+import generate_pdf
+import group_mngr
+from logger import log
+
+
+def main(argv=None):
+    """
+    Parses the command line and generates the report
+
+    :param argv:
+    Command line arguments, defaults to sys.argv
+    :return:
+    Exit code, 0 on success
+    """
+
+    parser = argparse.ArgumentParser(description="Generate a variant report "
+                                                 "from a DNA file")
+    parser.add_argument("dna_path",
+                        help="AncestryDNA or 23andMe raw data file, plain or "
+                             "gz, bz2 or zip compressed")
+    parser.add_argument("-o", "--output", default=".",
+                        help="Folder to write the report to")
+    parser.add_argument("-n", "--name", default=None,
+                        help="Name of the report, defaults to the DNA file's")
+    parser.add_argument("--header", default="",
+                        help="Paragraph at the top of the report")
+    parser.add_argument("--cache", action="store_true",
+                        help="Index the DNA file in the genotype cache, for "
+                             "files reported on again")
+    parser.add_argument("--progress-log", default=None,
+                        help="File to append progress events to, as JSON "
+                             "lines")
+    parser.add_argument("--profile", action="store_true",
+                        help="Save stage timings to PersistentData/timings")
+    parser.add_argument("--cprofile", action="store_true",
+                        help="Also save cProfile stats for the run")
+    parser.add_argument("--export", default=None,
+                        help="Dataset file to append the genotypes and "
+                             "results to")
+    parser.add_argument("--variant", action="append", default=[],
+                        metavar="NAME=GROUP,GROUP",
+                        help="Make a report on just these groups, can be "
+                             "given more than once")
+    args = parser.parse_args(argv)
+
+    filename = args.name or file_parser.base_name(args.dna_path)
+
+    if args.variant:
+        groups = group_mngr.load_groups()
+        reports = {}
+
+        for variant in args.variant:
+            name, _, group_names = variant.partition("=")
+            group_names = [group.strip() for group in group_names.split(",")]
+
+            missing = [group for group in group_names if group not in groups]
+            if not name or missing:
+                parser.error(f"Bad variant '{variant}', unknown groups: "
+                             f"{', '.join(missing)}")
+
+            reports[f"{filename}-{name}"] = {group: groups[group]
+                                             for group in group_names}
+    else:
+        reports = {filename: None}
+
+    try:
+        os.makedirs(args.output, exist_ok=True)
+
+        report_paths = generate_pdf.generate_many(
+            args.dna_path, args.header, reports, args.output,
+            use_cache=args.cache,
+            progress_log=args.progress_log,
+            profile=args.profile,
+            cprofile=args.cprofile,
+            export_path=args.export)
+
+    except ValueError as error:  # Called when invalid file is given
+        log(error)
+        print(f"File is not recognized as AncestryDNA or 23&Me file: "
+              f"{args.dna_path}", file=sys.stderr)
+        return 1
+
+    except OSError as error:  # Missing or unreadable file or folder
+        log(error)
+        print(f"Couldn't make the report: {error}", file=sys.stderr)
+        return 1
+
+    for name, report in report_paths.items():
+        log(f"Report '{name}' created in {args.output} from "
+            f"{args.dna_path}.")
+        print(report)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,301 @@
+"""
+
+Brandon Dunbar
+Cohort
+Runs the group panel over many DNA files and adds up what was found, for QC
+and population level notes
+
+Usage: python cohort.py <DNA files or directories> -o <output folder>
+
+Each worker process streams its share of the files through file_parser and
+counts into fixed size arrays: genotypes per RS id and results per gene.
+Memory depends on the panel's size, not the number of files.
+
+"""
+
+import argparse
+import csv
+import json
+import os
+from array import array
+from datetime import datetime
+
+import classify
+import file_parser
+import group_mngr
+import workers
+from logger import log
+
+SUMMARY_CSV = "cohort.csv"
+SUMMARY_JSON = "cohort.json"
+
+# Most files a worker takes at a time, its counts are sent back once per
+# chunk. Small runs use smaller chunks so every worker gets some.
+CHUNK_FILES = 16
+
+# Genotypes are counted unordered, A/G and G/A are the same
+_BASES = "ACGT"
+GENOTYPES = tuple(f"{one}/{two}" for index, one in enumerate(_BASES)
+                  for two in _BASES[index:]) + ("Other", "No call")
+
+_GENOTYPE_CODES = {}
+for _code, _genotype in enumerate(GENOTYPES[:-2]):
+    _one, _two = _genotype.split("/")
+    _GENOTYPE_CODES[_one, _two] = _GENOTYPE_CODES[_two, _one] = _code
+
+_OTHER = len(GENOTYPES) - 2
+_NO_CALL = len(GENOTYPES) - 1
+
+# Alleles the vendors use for a failed call
+_NO_CALL_ALLELES = {"0", "-"}
+
+class Panel:
+    """
+    The genes and RS ids being counted, in a fixed order so counts can be
+    kept in flat arrays
+    """
+
+    def __init__(self, groups):
+        """
+        :param groups:
+        The group dictionary
+        """
+
+        self.groups = groups
+
+        # [(group, gene), ] in group order, one result tally each
+        self.genes = [(group, gene) for group, genes in groups.items()
+                      for gene in genes]
+
+        self.rs_ids = sorted({gene.rs_id for group, gene in self.genes})
+        self.lookup = file_parser.build_lookup(groups)
+
+
+class Tally:
+    """
+    Counts for any number of files. Genotype counts are an array of
+    len(GENOTYPES) per RS id, result counts one of len(RESULT_NAMES) per
+    gene.
+    """
+
+    def __init__(self, panel):
+        """
+        :param panel:
+        The Panel being counted
+        """
+
+        self.files = 0
+        self.services = {}
+        self.failed = []  # [[dna_path, error], ]
+
+        self.genotypes = array("I", bytes(4 * len(GENOTYPES) *
+                                          len(panel.rs_ids)))
+        self.results = array("I", bytes(4 * len(classify.RESULT_NAMES) *
+                                        len(panel.genes)))
+
+    def add_file(self, panel, dna_path):
+        """
+        Parses a DNA file and counts its genotypes and results
+
+        :param panel:
+        The Panel being counted
+        :param dna_path:
+        Path to the DNA file
+        """
+
+        with file_parser.DnaFile(dna_path) as dna_file:
+            service = dna_file.vendor.name
+            pulled_genes = file_parser.parse(None, dna_file, service,
+                                             lookup=panel.lookup)
+
+        genotypes = self.genotypes
+        width = len(GENOTYPES)
+
+        for index, rs_id in enumerate(panel.rs_ids):
+            pulled_gene = pulled_genes.get(rs_id)
+
+            if pulled_gene is not None:
+                genotypes[index * width + _genotype_code(pulled_gene[2],
+                                                         pulled_gene[3])] += 1
+
+        results = self.results
+        width = len(classify.RESULT_NAMES)
+        codes = classify.classify([gene for group, gene in panel.genes],
+                                  service, pulled_genes)
+
+        # Plain ints, so the offsets can't overflow a narrow code type
+        for index, result in enumerate(codes.tolist()):
+            results[index * width + result] += 1
+
+        self.files += 1
+        self.services[service] = self.services.get(service, 0) + 1
+
+    def merge(self, other):
+        """
+        Adds another tally's counts to this one
+
+        :param other:
+        A Tally of the same panel
+        """
+
+        self.files += other.files
+        self.failed += other.failed
+
+        for service, files in other.services.items():
+            self.services[service] = self.services.get(service, 0) + files
+
+        for counts, other_counts in ((self.genotypes, other.genotypes),
+                                     (self.results, other.results)):
+            for index, count in enumerate(other_counts):
+                if count:
+                    counts[index] += count
+
+
+def _genotype_code(one, two):
+    """
+    :return:
+    The index of the genotype in GENOTYPES
+    """
+
+    one, two = one.upper(), two.upper()
+
+    if one in _NO_CALL_ALLELES or two in _NO_CALL_ALLELES:
+        return _NO_CALL
+
+    return _GENOTYPE_CODES.get((one, two), _OTHER)
+
+
+def _tally_files(dna_paths):
+    """
+    Counts a chunk of files in a worker process
+
+    :param dna_paths:
+    List of DNA file paths
+    :return:
+    The chunk's Tally
+    """
+
+    panel = workers.shared()
+    tally = Tally(panel)
+
+    for dna_path in dna_paths:
+        try:
+            tally.add_file(panel, dna_path)
+
+        except Exception as exception:  # One bad file mustn't stop the run
+            tally.failed.append([dna_path, repr(exception)])
+
+    return tally
+
+
+def run_cohort(dna_paths, groups=None, processes=None):
+    """
+    Counts genotypes and results for the panel over every DNA file, spread
+    over a process pool
+
+    :param dna_paths:
+    DNA file paths and directories holding DNA files
+    :param groups:
+    The groups to count, loaded once from disk if not given
+    :param processes:
+    Number of worker processes, defaults to the number of CPUs
+    :return:
+    (panel, tally)
+    """
+
+    if groups is None:
+        groups = group_mngr.load_groups()
+
+    panel = Panel(groups)
+    tally = Tally(panel)
+
+    if processes is None:
+        processes = os.cpu_count() or 1
+
+    dna_paths = workers.collect_dna_files(dna_paths)
+    chunk_files = max(1, min(CHUNK_FILES, len(dna_paths) // (processes * 4)))
+    chunks = [dna_paths[start:start + chunk_files]
+              for start in range(0, len(dna_paths), chunk_files)]
+
+    # The panel is sent to each worker once, not with every chunk of files
+    with workers.make_pool(processes, panel) as pool:
+
+        # Chunk counts are merged as they arrive, only a few are held
+        for chunk_tally in pool.imap_unordered(_tally_files, chunks):
+            tally.merge(chunk_tally)
+
+    return panel, tally
+
+
+def write_summary(panel, tally, output_path):
+    """
+    Writes the cohort summary: a CSV with a row per gene of its result and
+    genotype counts, and a JSON of the run's totals
+
+    :param panel:
+    The Panel that was counted
+    :param tally:
+    Its Tally
+    :param output_path:
+    Folder to write the summary to
+    :return:
+    Path of the CSV
+    """
+
+    os.makedirs(output_path, exist_ok=True)
+
+    rs_index = {rs_id: index for index, rs_id in enumerate(panel.rs_ids)}
+    genotype_width = len(GENOTYPES)
+    result_width = len(classify.RESULT_NAMES)
+
+    csv_path = os.path.join(output_path, SUMMARY_CSV)
+
+    with open(csv_path, "w", newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(["group", "gene", "rs_id", "files", "found"] +
+                        [name.lower().replace(" ", "_")
+                         for name in classify.RESULT_NAMES] +
+                        list(GENOTYPES))
+
+        for index, (group, gene) in enumerate(panel.genes):
+            results = tally.results[index * result_width:
+                                    (index + 1) * result_width]
+
+            start = rs_index[gene.rs_id] * genotype_width
+            genotypes = tally.genotypes[start:start + genotype_width]
+
+            writer.writerow([group, gene.name, gene.rs_id, tally.files,
+                             tally.files - results[classify.NOT_FOUND]] +
+                            list(results) + list(genotypes))
+
+    with open(os.path.join(output_path, SUMMARY_JSON), "w") as file:
+        json.dump({"created": datetime.now().isoformat(),
+                   "files": tally.files,
+                   "services": tally.services,
+                   "groups": len(panel.groups),
+                   "genes": len(panel.genes),
+                   "rs_ids": len(panel.rs_ids),
+                   "failed": tally.failed}, file, indent=2)
+
+    return csv_path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Count genotypes and "
+                                                 "results over many DNA "
+                                                 "files")
+    parser.add_argument("paths", nargs="+",
+                        help="DNA files or directories of DNA files")
+    parser.add_argument("-o", "--output", required=True,
+                        help="Folder to write the summary to")
+    parser.add_argument("-p", "--processes", type=int, default=None,
+                        help="Worker processes, defaults to the CPU count")
+    args = parser.parse_args()
+
+    cohort_panel, cohort_tally = run_cohort(args.paths,
+                                            processes=args.processes)
+    summary = write_summary(cohort_panel, cohort_tally, args.output)
+
+    log(f"Cohort of {cohort_tally.files} files summarised in {summary}, "
+        f"{len(cohort_tally.failed)} failed.")
+    print(summary)
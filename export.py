@@ -0,0 +1,281 @@
+"""
+
+Brandon Dunbar
+Export
+Saves each report's genotypes and results in a columnar file for analysis
+
+A dataset is one file of row groups, one appended per person. Each row group
+is a small header followed by its columns, each compressed on its own, so
+readers only decompress the columns a query needs:
+
+    b"EGX1", rows, header length    struct "<4sII"
+    header                          JSON: person, service, dna_path,
+                                    created and [[column, kind, bytes], ]
+    column data                     zlib compressed, in header order
+
+String columns are their values joined by NUL bytes, number columns are
+array bytes. to_arrow() loads a dataset into PyArrow, if it's installed.
+
+"""
+
+import json
+import struct
+import zlib
+from array import array
+from collections import Counter
+from datetime import datetime
+
+import classify
+from logger import FileLock
+
+try:
+    import pyarrow
+except ImportError:  # Optional, only needed for to_arrow()
+    pyarrow = None
+
+MAGIC = b"EGX1"
+_HEADER = struct.Struct("<4sII")
+
+# (column, kind) in the order they're written, kinds are "str" or an array
+# typecode
+COLUMNS = (("group", "str"),
+           ("gene", "str"),
+           ("rs_id", "str"),
+           ("chromosome", "str"),
+           ("position", "q"),
+           ("allele_one", "str"),
+           ("allele_two", "str"),
+           ("result", "b"))
+
+
+def _encode(values, kind):
+    if kind == "str":
+        data = "\0".join(values).encode()
+    else:
+        data = array(kind, values).tobytes()
+
+    return zlib.compress(data, 1)
+
+
+def _decode(data, kind, rows):
+    data = zlib.decompress(data)
+
+    if kind == "str":
+        return data.decode().split("\0") if rows else []
+
+    values = array(kind)
+    values.frombytes(data)
+
+    return values
+
+
+def _row_group(person, groups, pulled_genes, service, results, dna_path):
+    """
+    Encodes one person's genes as a row group
+
+    :return:
+    The row group's bytes
+    """
+
+    columns = {name: [] for name, kind in COLUMNS}
+
+    for group, genes in groups.items():
+        columns["result"].extend(results[group])
+
+        for gene in genes:
+            pulled_gene = pulled_genes.get(gene.rs_id)
+
+            if pulled_gene is None:
+                chromosome, position, one, two = "", -1, "", ""
+            else:
+                chromosome, position, one, two = pulled_gene[:4]
+
+            columns["group"].append(group)
+            columns["gene"].append(gene.name)
+            columns["rs_id"].append(gene.rs_id)
+            columns["chromosome"].append(chromosome)
+            columns["position"].append(int(position))
+            columns["allele_one"].append(one)
+            columns["allele_two"].append(two)
+
+    blobs = [_encode(columns[name], kind) for name, kind in COLUMNS]
+
+    header = json.dumps({"person": person,
+                         "service": service,
+                         "dna_path": dna_path,
+                         "created": datetime.now().isoformat(),
+                         "columns": [[name, kind, len(blob)] for
+                                     (name, kind), blob in
+                                     zip(COLUMNS, blobs)]}).encode()
+
+    rows = len(columns["result"])
+
+    return _HEADER.pack(MAGIC, rows, len(header)) + header + b"".join(blobs)
+
+
+def append(path, person, groups, pulled_genes, service, results=None,
+           dna_path=""):
+    """
+    Adds a person's genotypes and results to a dataset, creating it if
+    needed. Safe to call from several processes at once.
+
+    :param path:
+    Path of the dataset file
+    :param person:
+    Name the person's rows are saved under, e.g. the report name
+    :param groups:
+    The dictionary of groups and their gene objects
+    :param pulled_genes:
+    The genes pulled from the DNA file
+    :param service:
+    AncestryDNA or 23&Me
+    :param results:
+    The groups' result codes from classify.classify_groups, classified here
+    if not given
+    :param dna_path:
+    Path of the DNA file, recorded with the row group
+    """
+
+    if results is None:
+        results = classify.classify_groups(groups, service, pulled_genes)
+
+    data = _row_group(person, groups, pulled_genes, service, results,
+                      dna_path)
+
+    # Written in one go under the lock, so appends never interleave
+    with FileLock(f"{path}.lock"):
+        with open(path, "ab") as file:
+            file.write(data)
+
+
+def read(path, columns=None, people=None):
+    """
+    Reads a dataset one row group at a time, decompressing only the columns
+    asked for. A row group cut short by a crash mid-append is ignored.
+
+    :param path:
+    Path of the dataset file
+    :param columns:
+    Names of the columns to read, all of them if not given
+    :param people:
+    Only read these people's row groups, everyone's if not given
+    :return:
+    Generator of (header, {column: values}) tuples
+    """
+
+    with open(path, "rb") as file:
+        while True:
+            fixed = file.read(_HEADER.size)
+            if len(fixed) < _HEADER.size:
+                return
+
+            magic, rows, header_size = _HEADER.unpack(fixed)
+            if magic != MAGIC:
+                raise ValueError(f"{path} isn't an export dataset")
+
+            header = file.read(header_size)
+            if len(header) < header_size:
+                return
+
+            header = json.loads(header)
+            wanted = people is None or header["person"] in people
+
+            values = {}
+            for name, kind, size in header["columns"]:
+
+                if wanted and (columns is None or name in columns):
+                    data = file.read(size)
+                    if len(data) < size:
+                        return
+
+                    values[name] = _decode(data, kind, rows)
+
+                else:
+                    file.seek(size, 1)
+
+            if wanted:
+                yield header, values
+
+
+def result_counts(path, by="group", people=None):
+    """
+    Counts results across a dataset
+
+    :param path:
+    Path of the dataset file
+    :param by:
+    Column to count within, e.g. group or rs_id
+    :param people:
+    Only count these people, everyone if not given
+    :return:
+    Counter of {(value, result name): count}
+    """
+
+    counts = Counter()
+
+    for header, values in read(path, (by, "result"), people):
+        counts.update(zip(values[by], values["result"]))
+
+    return Counter({(value, classify.RESULT_NAMES[result]): count
+                    for (value, result), count in counts.items()})
+
+
+def genotype_counts(path, rs_ids=None, people=None):
+    """
+    Counts each RS id's genotypes across a dataset
+
+    :param path:
+    Path of the dataset file
+    :param rs_ids:
+    Only count these RS ids, all of them if not given
+    :param people:
+    Only count these people, everyone if not given
+    :return:
+    {rs_id: Counter({'A/G': count, })}, genes not found are left out
+    """
+
+    counts = Counter()
+
+    for header, values in read(path, ("rs_id", "allele_one", "allele_two"),
+                               people):
+        counts.update(zip(values["rs_id"], values["allele_one"],
+                          values["allele_two"]))
+
+    genotypes = {}
+    for (rs_id, one, two), count in counts.items():
+        if one and (rs_ids is None or rs_id in rs_ids):
+            genotypes.setdefault(rs_id, Counter())[f"{one}/{two}"] += count
+
+    return genotypes
+
+
+def to_arrow(path, columns=None, people=None):
+    """
+    Loads a dataset into a PyArrow table, with person and service columns
+    added from the row group headers
+
+    :param path:
+    Path of the dataset file
+    :param columns:
+    Names of the columns to load, all of them if not given
+    :param people:
+    Only load these people, everyone if not given
+    :return:
+    A pyarrow.Table
+    """
+
+    if pyarrow is None:
+        raise ImportError("to_arrow() needs PyArrow, pip install pyarrow")
+
+    batches = []
+    for header, values in read(path, columns, people):
+        rows = len(next(iter(values.values()), ()))
+        values["person"] = [header["person"]] * rows
+        values["service"] = [header["service"]] * rows
+        batches.append(pyarrow.table({name: list(column) for name, column
+                                      in values.items()}))
+
+    if not batches:
+        return pyarrow.table({})
+
+    return pyarrow.concat_tables(batches)
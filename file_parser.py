@@ -6,26 +6,480 @@ Extract and sort data from DNA files
 
 """
 
+import bz2
+import contextlib
+import gzip
+import io
+import mmap
+import os
+import re
+import zipfile
 
-def _pull(path):
+import formats
+import genotype_cache
+import region_index
+
+# Lines between progress callbacks while scanning
+_PROGRESS_LINES = 1 << 14
+
+# Extensions of DNA files, plain or compressed, for finding them in folders
+DNA_EXTENSIONS = (".txt", ".gz", ".bz2", ".zip")
+
+# (leading bytes, format) of the compressed files open_dna() can read
+_MAGIC = ((b"\x1f\x8b", "gzip"),
+          (b"BZh", "bz2"),
+          (b"PK\x03\x04", "zip"))
+
+
+def _compression(start):
+    """
+    Identifies a compressed file from its first bytes
+
+    :param start:
+    The file's first four bytes
+    :return:
+    "gzip", "bz2", "zip" or None for an uncompressed file
+    """
+
+    for magic, name in _MAGIC:
+        if start.startswith(magic):
+            return name
+
+    return None
+
+
+@contextlib.contextmanager
+def open_dna(path):
     """
-    pull()
+    Opens a DNA file for reading in binary. gzip, bz2 and zip files are
+    decompressed as they're read, never unpacked to disk. The format is
+    told by the file's first bytes rather than its name. From a zip, the
+    first .txt file is read, or its first file if there's no .txt.
+
     :param path:
-    Path of the file to be returned
+    Path of the DNA file
+    :return:
+    Context manager giving (file, raw): file reads the DNA data, raw is the
+    file on disk, whose tell() is how far through it reading has got
+    """
+
+    with contextlib.ExitStack() as stack:
+        raw = stack.enter_context(open(path, "rb"))
+        compression = _compression(raw.read(4))
+        raw.seek(0)
+
+        # The decompressors are wrapped in a BufferedReader, whose
+        # readline is much faster than theirs
+
+        if compression == "gzip":
+            file = stack.enter_context(
+                io.BufferedReader(gzip.GzipFile(fileobj=raw), 1 << 16))
+
+        elif compression == "bz2":
+            file = stack.enter_context(
+                io.BufferedReader(bz2.BZ2File(raw), 1 << 16))
+
+        elif compression == "zip":
+            archive = stack.enter_context(zipfile.ZipFile(raw))
+            members = [member for member in archive.infolist()
+                       if not member.is_dir()]
+
+            if not members:
+                raise ValueError(f"No files in {path}")
+
+            member = next((member for member in members
+                           if member.filename.lower().endswith(".txt")),
+                          members[0])
+            file = stack.enter_context(
+                io.BufferedReader(archive.open(member), 1 << 16))
+
+        else:
+            file = raw
+
+        yield file, raw
+
+
+def base_name(path):
+    """
+    The name of a DNA file without its extensions, e.g. dna for
+    dna.txt.gz
+
+    :param path:
+    Path of the DNA file
+    :return:
+    The name
+    """
+
+    name, extension = os.path.splitext(os.path.basename(path))
+
+    if extension in (".gz", ".bz2", ".zip"):
+        name = os.path.splitext(name)[0]
+
+    return name
+
+
+class DnaFile:
+    """
+    A DNA file opened once with open_dna() and shared by format detection
+    and parsing. The vendor is sniffed from the bytes already buffered, so
+    detecting it costs no extra read. Use as a context manager.
+    """
+
+    def __init__(self, path):
+        """
+        :param path:
+        Path of the DNA file
+        """
+
+        self.path = path
+        self._stack = contextlib.ExitStack()
+        self.file, self.raw = self._stack.enter_context(open_dna(path))
+
+        # Size on disk, compressed files are tracked by their raw position
+        self.size = os.fstat(self.raw.fileno()).st_size
+
+        self.first_line = self.file.peek(1 << 12).split(b"\n", 1)[0] \
+            .decode(errors="replace")
+        self._vendor = None
+
+    @property
+    def vendor(self):
+        """The file's formats.VendorFormat, raises ValueError if unknown."""
+
+        if self._vendor is None:
+            self._vendor = formats.detect(self.first_line)
+
+        return self._vendor
+
+    @property
+    def compressed(self):
+        return self.file is not self.raw
+
+    def rewind(self):
+        """Goes back to the start, for another pass over the file."""
+
+        if self.file.tell():
+            self.file.seek(0)
+
+    def close(self):
+        self._stack.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+@contextlib.contextmanager
+def _opened(dna_path):
+    """
+    Gives a DnaFile at its start, opening the path if it isn't one already.
+    Files opened here are closed again, those passed in are left open.
+    """
+
+    if isinstance(dna_path, DnaFile):
+        dna_path.rewind()
+        yield dna_path
+
+    else:
+        with DnaFile(dna_path) as dna_file:
+            yield dna_file
+
+
+def _stream(dna_file, needed_genes, stats=None, progress=None):
+    """
+    Yields the rows of the file whose RS id is wanted, and stops reading as
+    soon as every wanted RS id has been found.
+
+    The file is read in binary and only the RS id at the start of each line
+    is compared, so the other ~700k lines are never decoded or split.
+
+    :param dna_file:
+    The open DnaFile, at its start
+    :param needed_genes:
+    Set of RS ids to pull
+    :param stats:
+    Optional dictionary, filled with how much of the file was read and
+    skipped once the generator is exhausted
+    :param progress:
+    Optional progress.Progress, sent parse events as it goes
+    :return:
+    A generator object of the matching rows, returning lists
+    """
+
+    outstanding = {rs_id.encode() for rs_id in needed_genes}
+    lines_read = 0
+    raw = dna_file.raw
+
+    for line in dna_file.file:
+        lines_read += 1
+
+        if progress is not None and not lines_read % _PROGRESS_LINES:
+            found = len(needed_genes) - len(outstanding)
+            progress.emit("parse", bytes_read=raw.tell(),
+                          bytes_total=dna_file.size, lines_scanned=lines_read,
+                          genes_matched=found)
+
+        # Comment lines start with "#" and never match an RS id
+        rs_id = line.split(b"\t", 1)[0]
+
+        if rs_id in outstanding:
+            outstanding.discard(rs_id)
+            yield [i.strip() for i in line.decode().split("\t")]
+
+            if not outstanding:  # Everything found, skip the rest
+                break
+
+    # Of the file on disk, so compressed files count compressed bytes
+    if stats is not None:
+        _record_stats(stats, dna_file, lines_read, raw.tell())
+
+
+def _scan_mmap(dna_file, needed_genes, stats=None, progress=None):
+    """
+    Yields the rows of the file whose RS id is wanted, searching the memory
+    mapped file directly. The wanted RS ids are compiled into one pattern
+    anchored at line starts, so lines that don't match are never copied out
+    of the map. Stops once every wanted RS id has been found.
+
+    :param dna_file:
+    The open DnaFile
+    :param needed_genes:
+    Set of RS ids to pull
+    :param stats:
+    Optional dictionary, filled with how much of the file was read and
+    skipped once the generator is exhausted
+    :param progress:
+    Optional progress.Progress, sent parse events as it goes
+    :return:
+    A generator object of the matching rows, returning lists
+    """
+
+    if dna_file.compressed:  # Only the compressed bytes can be mapped
+        yield from _stream(dna_file, needed_genes, stats, progress)
+        return
+
+    outstanding = {rs_id.encode() for rs_id in needed_genes}
+    pattern = re.compile(rb"^(" + _trie_pattern(outstanding) + rb")\t[^\n]*",
+                         re.MULTILINE)
+    bytes_read = 0
+    lines_read = 0
+
+    if dna_file.size == 0:  # Empty files can't be mapped
+        if stats is not None:
+            _record_stats(stats, dna_file, 0, 0)
+        return
+
+    with mmap.mmap(dna_file.raw.fileno(), 0,
+                   access=mmap.ACCESS_READ) as buffer:
+
+        bytes_read = len(buffer)
+
+        for match in pattern.finditer(buffer):
+            rs_id = match.group(1)
+
+            if rs_id in outstanding:  # Only the first row of an RS id
+                outstanding.discard(rs_id)
+
+                if progress is not None:
+                    found = len(needed_genes) - len(outstanding)
+                    progress.emit("parse", bytes_read=match.end(),
+                                  bytes_total=len(buffer),
+                                  lines_scanned=None, genes_matched=found)
+
+                row = match.group().decode()
+                yield [i.strip() for i in row.split("\t")]
+
+                if not outstanding:  # Everything found, skip the rest
+                    bytes_read = min(match.end() + 1, len(buffer))
+                    break
+
+        if stats is not None:
+            lines_read = _count_lines(buffer, bytes_read)
+
+    if stats is not None:
+        _record_stats(stats, dna_file, lines_read, bytes_read)
+
+
+def _trie_pattern(words):
+    """
+    Builds a regex matching any of the words, with shared prefixes factored
+    out ("rs1|rs12" becomes "rs1(?:2)?"). A plain alternation makes the regex
+    engine try every word at every line start, which is slow for thousands
+    of RS ids.
+
+    :param words:
+    The byte strings to match
+    :return:
+    The regex pattern, as bytes
+    """
+
+    trie = {}
+    for word in words:
+        node = trie
+        for byte in word:
+            node = node.setdefault(byte, {})
+        node[None] = None  # Marks the end of a word
+
+    def build(node):
+        branches = [re.escape(bytes([byte])) + build(child)
+                    for byte, child in sorted(item for item in node.items()
+                                              if item[0] is not None)]
+
+        if not branches:
+            return b""
+
+        if len(branches) == 1 and None not in node:
+            return branches[0]
+
+        pattern = b"(?:" + b"|".join(branches) + b")"
+
+        if None in node:  # A word ends here, the rest is optional
+            return pattern + b"?"
+
+        return pattern
+
+    return build(trie)
+
+
+def _count_lines(buffer, end, chunk_size=1 << 20):
+    """
+    Counts the lines in the first end bytes of a memory mapped file, a chunk
+    at a time so the region is never copied out whole
+
+    :param buffer:
+    The mapped file
+    :param end:
+    Offset to count up to
+    :param chunk_size:
+    Bytes to copy per count
     :return:
-    A generator object of the file, returning lists
+    The number of lines
+    """
+
+    lines = 0
+    for start in range(0, end, chunk_size):
+        lines += buffer[start:min(start + chunk_size, end)].count(b"\n")
+
+    # A last line without a newline still counts
+    if end and buffer[end - 1:end] != b"\n":
+        lines += 1
+
+    return lines
+
+
+# Scanners parse() can use, each yielding the wanted rows as lists of fields
+_BACKENDS = {"stream": _stream,
+             "mmap": _scan_mmap}
+
+
+def _record_stats(stats, dna_file, lines_read, bytes_read):
+    """
+    Fills in the read/skip counts of a parse
+
+    :param stats:
+    The dictionary to fill
+    :param dna_file:
+    The DnaFile
+    :param lines_read:
+    Lines read before the scan stopped
+    :param bytes_read:
+    Bytes read before the scan stopped
     """
 
-    with open(path, "r") as file:
+    bytes_skipped = dna_file.size - bytes_read
+
+    # Lines after the stopping point are never read, so estimate them from
+    # the average length of the lines that were
+    if bytes_read:
+        lines_skipped = round(bytes_skipped * lines_read / bytes_read)
+    else:
+        lines_skipped = 0
+
+    stats.update(lines_read=lines_read,
+                 bytes_read=bytes_read,
+                 lines_skipped=lines_skipped,
+                 bytes_skipped=bytes_skipped)
 
-        for line in file:
 
-            if not line.startswith("#"):
+def build_lookup(groups):
+    """
+    Collects the RS ids of every gene in the groups into a set, so checking
+    a line of the DNA file against the panel doesn't depend on panel size.
+    Build it once per group set and pass it to parse() when parsing several
+    files against the same groups.
+
+    :param groups:
+    The dictionary of groups and their gene objects
+    :return:
+    A frozenset of RS ids
+    """
 
-                yield [i.strip() for i in line.split("\t")]
+    return frozenset(gene.rs_id for group in groups.values() for gene in group)
 
 
-def parse(groups, dna_path, service):
+def _rows(dna_file, decode, stats=None, progress=None, regions=None):
+    """
+    Decodes every genotype row of the file, for building the genotype cache
+    and region index
+
+    :param dna_file:
+    The open DnaFile, at its start
+    :param decode:
+    The vendor's row decoder
+    :param stats:
+    Optional dictionary, filled with how much of the file was read
+    :param progress:
+    Optional progress.Progress, sent parse events as it goes
+    :param regions:
+    Optional region_index.RegionIndex to add every row to
+    :return:
+    A generator of [rs#, chromosome, position, allele1, allele2] lists
+    """
+
+    lines_read = 0
+    offset = 0  # Of the line in the decompressed file
+    raw = dna_file.raw
+
+    # Every line gets decoded here, and text mode does that fastest.
+    # newline='' keeps line endings so len(line) is its size in bytes. UTF-8
+    # as the byte scanners decode, not the locale's encoding.
+    text = io.TextIOWrapper(dna_file.file, encoding="utf-8", newline='')
+
+    try:
+        for line in text:
+            lines_read += 1
+            line_offset = offset
+            offset += len(line) if line.isascii() else len(line.encode())
+
+            if progress is not None and not lines_read % _PROGRESS_LINES:
+                progress.emit("parse", bytes_read=raw.tell(),
+                              bytes_total=dna_file.size,
+                              lines_scanned=lines_read, genes_matched=None)
+
+            row = line.rstrip().split("\t")
+
+            # Skip comments, AncestryDNA's column header and blank lines
+            if row[0].startswith("#") or row[0] == "rsid" or len(row) < 4:
+                continue
+
+            rs_id, genotype = decode(row)
+
+            if regions is not None:
+                regions.add(genotype[0], genotype[1], line_offset)
+
+            yield [rs_id] + genotype
+
+    finally:
+        text.detach()  # Leave the DnaFile open
+
+    if stats is not None:
+        _record_stats(stats, dna_file, lines_read, raw.tell())
+
+
+def parse(groups, dna_path, service=None, lookup=None, stats=None,
+          backend="stream", use_cache=False, progress=None):
     """
     Sorts through the provided gene text files and returns the relevant
     genes
@@ -33,37 +487,215 @@ def parse(groups, dna_path, service):
     :param groups:
     The dictionary of groups and their gene objects
     :param dna_path:
-    The path to the DNA txt file
+    The path to the DNA txt file, or an open DnaFile to share its handle
     :param service:
-    23&Me or AncestryDNA
+    23&Me or AncestryDNA, detected from the file if not given
+    :param lookup:
+    Optional set of RS ids from build_lookup(), built from groups if omitted
+    :param stats:
+    Optional dictionary to fill with lines_read, bytes_read, lines_skipped
+    (estimated) and bytes_skipped
+    :param backend:
+    "stream" to read the file line by line, "mmap" to search a memory map
+    of it
+    :param use_cache:
+    Look the genes up in the file's genotype cache index, building it with
+    a full scan of the file if there isn't one yet
+    :param progress:
+    Optional progress.Progress, sent parse events during the scan and a
+    final one with the totals
     :return:
     A list of shared SNPs
     """
 
     # Get the genes from the group file----------------------------------------
-    needed_genes = [gene.rs_id for group in groups.values() for gene in group]
+    if lookup is None:
+        needed_genes = build_lookup(groups)
+    else:
+        needed_genes = lookup
+
+    try:
+        scan = _BACKENDS[backend]
+    except KeyError:
+        raise ValueError(f"Unknown parse backend: {backend}")
 
-    if needed_genes:  # If there are any genes to search for-------------------
+    vendor = None if service is None else formats.get(service)
 
-        # Dictionaries from files in the format:
-        # {rs#: [chromosome, position, allele1, allele2], ...}
+    if not needed_genes:  # If there are no genes to search for
+        return {}
 
-        if service == "AncestryDNA":
-            genes = {_gene[0]: _gene[1:]
-                     for _gene in _pull(dna_path)
-                     if _gene[0] in needed_genes}
+    if progress is not None and stats is None:
+        stats = {}  # The final progress event reports the totals
+
+    with _opened(dna_path) as dna_file:
+        if vendor is None:
+            vendor = dna_file.vendor
+
+        genes = _pull_genes(dna_file, needed_genes, vendor.decode, scan,
+                            stats, use_cache, progress)
+
+    if progress is not None:
+        progress.emit("parse",
+                      bytes_read=stats["bytes_read"],
+                      bytes_total=stats["bytes_read"] + stats["bytes_skipped"],
+                      lines_scanned=stats["lines_read"],
+                      genes_matched=len(genes))
+
+    return genes
 
-            return genes
 
-        elif service == "23&Me":
-            # 23&me has the last two alleles together with no space separating
-            # them, we need to work around this.
-            genes = {_gene[0]: _gene[1:-1] + [_gene[-1][0], _gene[-1][1]]
-                     for _gene in _pull(dna_path)
-                     if _gene[0] in needed_genes}
+def parse_many(group_sets, dna_path, service=None, stats=None,
+               backend="stream", use_cache=False, progress=None):
+    """
+    Pulls the genes for several sets of groups (e.g. the variants of a
+    multi-report order) with a single scan of the DNA file, against the
+    union of their RS ids
+
+    :param group_sets:
+    {'Name': <groups dictionary>, }
+    :param dna_path:
+    The path to the DNA txt file, or an open DnaFile
+    :param service:
+    23&Me or AncestryDNA, detected from the file if not given
+    :param stats:
+    Optional dictionary to fill with the scan's stats, see parse()
+    :param backend:
+    "stream" or "mmap", see parse()
+    :param use_cache:
+    Use the genotype cache, see parse()
+    :param progress:
+    Optional progress.Progress, sent the scan's parse events
+    :return:
+    {'Name': <the genes parse() would return for its groups>, }, sharing
+    the pulled genotypes
+    """
+
+    lookups = {name: build_lookup(groups)
+               for name, groups in group_sets.items()}
+
+    union = frozenset().union(*lookups.values())
+    genes = parse(None, dna_path, service, union, stats, backend, use_cache,
+                  progress)
+
+    return {name: {rs_id: genes[rs_id] for rs_id in lookup if rs_id in genes}
+            for name, lookup in lookups.items()}
+
+
+def _pull_genes(dna_file, needed_genes, decode, scan, stats, use_cache,
+                progress):
+    """
+    Pulls the wanted genes with the scanner or the genotype cache, see
+    parse()
+    """
+
+    # Dictionaries from files in the format:
+    # {rs#: [chromosome, position, allele1, allele2], ...}
+
+    if use_cache:
+        genes = genotype_cache.fetch(dna_file.path, needed_genes)
+
+        if genes is None:  # Not indexed yet, index the whole file
+            regions = region_index.RegionIndex()
+            genes = {}
+
+            def rows():
+                # Picks out the wanted genes as the rows stream into the
+                # index
+                for row in _rows(dna_file, decode, stats, progress, regions):
+                    if row[0] in needed_genes and row[0] not in genes:
+                        genes[row[0]] = row[1:]
+
+                    yield row
+
+            genotype_cache.store(dna_file.path, rows())
+            regions.save(dna_file.path)
+
+        elif stats is not None:
+            _record_stats(stats, dna_file, 0, 0)
+
+        return genes
+
+    return dict(decode(_gene)
+                for _gene in scan(dna_file, needed_genes, stats, progress))
+
+
+def parse_regions(dna_path, regions, service=None):
+    """
+    Pulls every genotype in chromosome regions, e.g. the span of a gene.
+    Uses the file's region index to read only the blocks holding each
+    region, building the index with a full scan the first time.
+
+    :param dna_path:
+    The path to the DNA txt file, or an open DnaFile
+    :param regions:
+    List of (chromosome, first position, last position) tuples, the
+    chromosome as it's written in the file and positions inclusive
+    :param service:
+    23&Me or AncestryDNA, detected from the file if not given
+    :return:
+    {rs#: [chromosome, position, allele1, allele2], } like parse()
+    """
+
+    vendor = None if service is None else formats.get(service)
+
+    with _opened(dna_path) as dna_file:
+        if vendor is None:
+            vendor = dna_file.vendor
+
+        index = region_index.load(dna_file.path)
+
+        if index is None or not index.sorted:
+
+            # Check every row, building the index on the way if needed
+            building = region_index.RegionIndex() if index is None else None
+            genes = {}
+
+            for row in _rows(dna_file, vendor.decode, regions=building):
+                if row[0] not in genes and _in_regions(row, regions):
+                    genes[row[0]] = row[1:]
+
+            if building is not None:
+                building.save(dna_file.path)
 
             return genes
 
-    else:
-        return {}
+        genes = {}
+        for chromosome, start, end in regions:
+            offset = index.seek_offset(chromosome, start)
+            if offset is None:
+                continue
+
+            dna_file.file.seek(offset)
+
+            for line in dna_file.file:
+                row = line.decode().rstrip().split("\t")
+
+                if len(row) < 4:  # Blank line at the end of the file
+                    break
+
+                rs_id, genotype = vendor.decode(row)
+
+                # The chromosome's rows are together and sorted, so the
+                # region ends at the first row past it
+                if genotype[0] != chromosome or int(genotype[1]) > end:
+                    break
+
+                if int(genotype[1]) >= start and rs_id not in genes:
+                    genes[rs_id] = genotype
+
+        return genes
+
+
+def _in_regions(row, regions):
+    """
+    Whether a [rs#, chromosome, position, allele1, allele2] row falls in any
+    of the (chromosome, first position, last position) regions
+    """
+
+    try:
+        position = int(row[2])
+    except ValueError:
+        return False
 
+    return any(row[1] == chromosome and start <= position <= end
+               for chromosome, start, end in regions)
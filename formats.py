@@ -0,0 +1,126 @@
+"""
+
+Brandon Dunbar
+Formats
+The DNA file formats the program reads, one per vendor
+
+Each vendor registers a VendorFormat: how to recognise its files from their
+first line, how to decode its rows and which of a gene's wild/variant
+columns apply to it. Supporting another vendor means registering one more.
+
+"""
+
+# {lower cased name: VendorFormat}, in the order they're tried
+_formats = {}
+
+
+class VendorFormat:
+    """
+    How to read one vendor's raw data files
+    """
+
+    def __init__(self, name, sniff, decode, wild, variant):
+        """
+        :param name:
+        Name of the service, e.g. AncestryDNA
+        :param sniff:
+        Function taking the file's first line, True if the file is this
+        vendor's
+        :param decode:
+        Function turning a row's list of fields into
+        (rs#, [chromosome, position, allele1, allele2])
+        :param wild:
+        Gene attribute holding the wild type alleles for this vendor
+        :param variant:
+        Gene attribute holding the variant alleles for this vendor
+        """
+
+        self.name = name
+        self.sniff = sniff
+        self.decode = decode
+        self.wild = wild
+        self.variant = variant
+
+    def __repr__(self):
+        return f"VendorFormat({self.name})"
+
+
+def register(vendor_format):
+    """
+    Adds a vendor's format, replacing any registered under the same name
+
+    :param vendor_format:
+    The VendorFormat
+    """
+
+    _formats[vendor_format.name.lower()] = vendor_format
+
+
+def get(service):
+    """
+    Finds a vendor's format by name, ignoring case
+
+    :param service:
+    Name of the service, e.g. 23&Me
+    :return:
+    The VendorFormat
+    """
+
+    try:
+        return _formats[service.lower()]
+    except KeyError:
+        raise ValueError(f"Unknown service: {service}")
+
+
+def detect(first_line):
+    """
+    Finds the format of a file from its first line
+
+    :param first_line:
+    The file's first line, as text
+    :return:
+    The VendorFormat
+    """
+
+    for vendor_format in _formats.values():
+        if vendor_format.sniff(first_line):
+            return vendor_format
+
+    raise ValueError("Invalid file!")
+
+
+def _decode_ancestry(row):
+    """
+    AncestryDNA rows are already [rs#, chromosome, position, allele1,
+    allele2]
+    """
+
+    return row[0], row[1:]
+
+
+def _decode_23andme(row):
+    """
+    23&me has the last two alleles together with no space separating them,
+    we need to work around this. Single allele calls (X, Y and MT in men)
+    are repeated.
+    """
+
+    genotype = row[-1]
+
+    if len(genotype) == 1:
+        genotype = genotype * 2
+
+    return row[0], row[1:-1] + [genotype[0], genotype[1]]
+
+
+register(VendorFormat("AncestryDNA",
+                      lambda first_line: "AncestryDNA" in first_line,
+                      _decode_ancestry,
+                      wild="anc_wild",
+                      variant="anc_var"))
+
+register(VendorFormat("23&Me",
+                      lambda first_line: "23andMe" in first_line,
+                      _decode_23andme,
+                      wild="tt_wild",
+                      variant="tt_var"))
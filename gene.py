@@ -6,18 +6,36 @@ A script to hold the Gene class
 
 """
 
+import sys
+
+# The attributes of a gene, in the order get_attributes() lists them
+FIELDS = ("name", "rs_id", "tt_wild", "tt_var", "anc_wild", "anc_var",
+          "red_notes", "yellow_notes", "green_notes")
+
+# One copy of each distinct note text, shared by every gene that uses it
+_notes = {}
+
+
+def _share(text):
+    """
+    Returns the shared copy of a note, so identical notes across genes and
+    groups are only held in memory once
+
+    :param text:
+    The note text
+    :return:
+    The shared string
+    """
+
+    return _notes.setdefault(text, text)
+
 
 class Gene:
+    # No per instance __dict__, genes are held by the thousand
+    __slots__ = FIELDS
+
     def __init__(self, attributes):
-        self.name = attributes[0]
-        self.rs_id = attributes[1]
-        self.tt_wild = attributes[2]
-        self.tt_var = attributes[3]
-        self.anc_wild = attributes[4]
-        self.anc_var = attributes[5]
-        self.red_notes = attributes[6]
-        self.yellow_notes = attributes[7]
-        self.green_notes = attributes[8]
+        self.set_attributes(attributes)
 
     def __repr__(self):
         return self.rs_id
@@ -25,6 +43,23 @@ class Gene:
     def __str__(self):
         return self.rs_id
 
+    def __getstate__(self):
+        return dict(zip(FIELDS, self.get_attributes()))
+
+    def __setstate__(self, state):
+        """
+        Restores a pickled gene. Genes pickled before __slots__ store their
+        __dict__, which is the same {attribute: value} dictionary.
+
+        :param state:
+        {attribute: value}, or a (dict, slots) pair
+        """
+
+        if isinstance(state, tuple):
+            state = {**(state[0] or {}), **(state[1] or {})}
+
+        self.set_attributes([state[field] for field in FIELDS])
+
     def get_attributes(self):
         """
         Returns a list of gene attributes.
@@ -52,12 +87,14 @@ class Gene:
         A list of values to set class attributes to.
         """
 
-        self.name = attributes[0]
-        self.rs_id = attributes[1]
-        self.tt_wild = attributes[2]
-        self.tt_var = attributes[3]
-        self.anc_wild = attributes[4]
-        self.anc_var = attributes[5]
-        self.red_notes = attributes[6]
-        self.yellow_notes = attributes[7]
-        self.green_notes = attributes[8]
+        # Names, RS ids and allele codes are short and endlessly repeated,
+        # intern them
+        self.name = sys.intern(attributes[0])
+        self.rs_id = sys.intern(attributes[1])
+        self.tt_wild = sys.intern(attributes[2])
+        self.tt_var = sys.intern(attributes[3])
+        self.anc_wild = sys.intern(attributes[4])
+        self.anc_var = sys.intern(attributes[5])
+        self.red_notes = _share(attributes[6])
+        self.yellow_notes = _share(attributes[7])
+        self.green_notes = _share(attributes[8])
@@ -13,52 +13,136 @@ from reportlab.platypus import Image, Paragraph, SimpleDocTemplate, Table, \
 from reportlab.lib.units import inch
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 
-from datetime import datetime
+import copy
+import io
+import os
 
+import classify
+import export
 import group_mngr
 import file_parser
+import logger
+from progress import Progress, BarSink, JsonLinesSink
+from profiling import Profiler, NullProfiler
 
+# Cell colors for red, yellow and green results, in format_group's note order
+RESULT_COLORS = (colors.red, colors.yellow, colors.green)
 
-def _detect_service(dna_path):
+# Rows per group table, longer groups are split over several tables
+TABLE_ROWS = 200
+
+REPORT_TITLE = "Empowered Genetics Variant Report"
+LOGO_PATH = "PersistentData/eg.jpg"
+
+# First row of each group's table
+TABLE_LEGEND = ("Gene", "RS#", "Wild/Var", "Result",)
+
+# Built on first use by _get_styles()
+_styles = None
+
+# Flowables every report shares, built on first use by _get_templates()
+_templates = {}
+
+
+def _get_styles():
     """
-    Detects whether file is AncestryDNA or 23&me
+    Returns the report's stylesheet, building it on the first call.
+    Building a stylesheet creates a whole object graph, so every report and
+    gene shares this one.
 
-    :param dna_path:
-    Path to dna file
+    Adds to ReportLab's sample styles:
+    ReportTitle - The report title
+    GroupTitle - Each group's name
+    Legend - The header row of each group's table
 
     :return:
-    String specifying active service
+    The stylesheet
     """
 
-    with open(dna_path, 'r') as file:
+    global _styles
 
-        first_line = file.readline()
+    if _styles is None:
+        styles = getSampleStyleSheet()
 
-        if "AncestryDNA" in first_line:
-            return 'AncestryDNA'
+        styles.add(ParagraphStyle("ReportTitle",
+                                  parent=styles["h1"],
+                                  textColor=colors.HexColor("#5A8782")))
+        styles.add(ParagraphStyle("GroupTitle",
+                                  parent=styles["h2"],
+                                  textColor=colors.HexColor("#516170")))
+        styles.add(ParagraphStyle("Legend",
+                                  fontName="Helvetica",
+                                  fontSize=10,
+                                  textColor=colors.black))
 
-        elif "23andMe" in first_line:
-            return '23&Me'
+        _styles = styles
 
-        else:
-            raise ValueError("Invalid file!")
+    return _styles
 
 
-def _log_not_found(not_found):
+def _get_templates(header):
     """
-    Logs the RS ids not found to a text file
+    Returns the flowables that open every report: the logo, title, header
+    and the divider between groups. They're built once per process and
+    copied into each report, the copies share the parsed text and the
+    decoded logo. The logo is read again if its file changes, the header
+    if it's different from the last report's.
 
-    :param not_found:
-    A list of genes not found
+    :param header:
+    The top level paragraph
+    :return:
+    {'logo': <Image>, 'title': <Paragraph>, 'header': <Paragraph>,
+     'line': <MCLine>}
     """
 
-    with open("PersistentData/not_founds.txt", "a") as file:
-        file.write(f"{datetime.now()}:\n")
-        for gene in not_found:
-            file.write(str(gene) + "\n")
+    styles = _get_styles()
+
+    if "title" not in _templates:
+        _templates["title"] = Paragraph(REPORT_TITLE, styles["ReportTitle"])
+        _templates["line"] = MCLine(500)
+
+    stat = os.stat(LOGO_PATH)
+    logo_stamp = (stat.st_mtime_ns, stat.st_size)
 
+    if _templates.get("logo_stamp") != logo_stamp:
+        with open(LOGO_PATH, "rb") as file:
+            _templates["logo"] = Image(io.BytesIO(file.read()),
+                                       1.5*inch, 1.5*inch)
+        _templates["logo_stamp"] = logo_stamp
 
-def format_group(genes, service, pulled_genes):
+    if _templates.get("header_text") != header:
+        _templates["header"] = Paragraph(header, styles["df"])
+        _templates["header_text"] = header
+
+    return {name: copy.copy(_templates[name])
+            for name in ("logo", "title", "header", "line")}
+
+
+def _detect_service(dna_file, progress=None):
+    """
+    Detects which vendor's format the file is in, e.g. AncestryDNA or 23&me,
+    from the bytes the file has already buffered
+
+    :param dna_file:
+    The open file_parser.DnaFile
+
+    :param progress:
+    Optional progress.Progress, sent a detect event
+
+    :return:
+    String specifying active service
+    """
+
+    service = dna_file.vendor.name  # Raises ValueError for unknown files
+
+    if progress is not None:
+        progress.emit("detect", bytes_read=len(dna_file.first_line),
+                      service=service)
+
+    return service
+
+
+def format_group(genes, service, pulled_genes, results=None, progress=None):
     """
     Takes group dictionary and reformats it to be written to the pdf.
 
@@ -71,6 +155,12 @@ def format_group(genes, service, pulled_genes):
     :param pulled_genes:
     The genes pulled from the DNA files
 
+    :param results:
+    The group's result codes from classify, classified here if not given
+
+    :param progress:
+    Optional progress.Progress, sent a format event
+
     :return:
     A tuple to be passed directly to reportlab's Table object and fill the data
     parameter
@@ -85,48 +175,39 @@ def format_group(genes, service, pulled_genes):
     gene_name, rsid, trait_wild, trait_var, red_notes, yellow notes, green notes
     """
 
+    if results is None:
+        results = classify.classify(genes, service, pulled_genes)
+
+    styles = _get_styles()
     formatted_group = []
     yellow = []
     red = []
     green = []
     not_found = []
 
-    for index, gene in enumerate(genes):
+    for index, (gene, result) in enumerate(zip(genes, results)):
 
         # Declare variables for readability------------------------------------
         try:
             pulled_gene = pulled_genes[gene.rs_id]
-            chromosome = pulled_gene[0]
-            position = pulled_gene[1]
             trait_one = pulled_gene[2]
             trait_two = pulled_gene[3]
 
         except KeyError:
             trait_one, trait_two = 'X', 'X'
 
-        # Get the target service-----------------------------------------------
-        if service == "23&me":
-            wild = gene.tt_wild
-            variant = gene.tt_var
-
-        else:
-            wild = gene.anc_wild
-            variant = gene.anc_var
-
-        styles = getSampleStyleSheet()
         trait_pair = f"{trait_one}/{trait_two}"
 
-        # Check green, red, or yellow------------------------------------------
+        # Green, red, or yellow------------------------------------------------
 
         # Not Found:
-        if trait_one == 'X' and trait_two == 'X':
+        if result == classify.NOT_FOUND:
 
             trait_result = Paragraph("Not found", styles['BodyText'])
             not_found.append(gene.rs_id)
 
         # Green:
-        elif trait_one.upper() == wild.upper() and \
-                trait_two.upper() == wild.upper():
+        elif result == classify.GREEN:
 
             # Create paragraph object
             trait_result = Paragraph(gene.green_notes, styles['BodyText'])
@@ -135,8 +216,7 @@ def format_group(genes, service, pulled_genes):
             green.append((3, index+1))
 
         # Red
-        elif trait_one.upper() == variant.upper() and \
-                trait_two.upper() == variant.upper():
+        elif result == classify.RED:
 
             # Create paragraph object
             trait_result = Paragraph(gene.red_notes, styles['BodyText'])
@@ -163,13 +243,203 @@ def format_group(genes, service, pulled_genes):
     notes = [red, yellow, green]
 
     if not_found:
-        _log_not_found(not_found)
+        logger.log_not_found(not_found)
+
+    if progress is not None:
+        progress.emit("format", genes=len(genes),
+                      genes_matched=len(genes) - len(not_found))
 
     return formatted_group, notes
 
 
+def _table_style(gene_notes, legend=True):
+    """
+    Builds a group table's whole style in one go: the legend row's font and
+    the result cell highlights. Runs of adjacent cells with the same color
+    share a single range command, so ReportLab processes one command per
+    run rather than two per cell.
+
+    :param gene_notes:
+    The [red, yellow, green] cell lists from format_group
+    :param legend:
+    Style the first row as the legend
+    :return:
+    A TableStyle
+    """
+
+    commands = []
+
+    if legend:
+        legend_style = _get_styles()["Legend"]
+        commands += [('FONT', (0, 0), (-1, 0), legend_style.fontName,
+                      legend_style.fontSize),
+                     ('TEXTCOLOR', (0, 0), (-1, 0), legend_style.textColor)]
+
+    # {(column, row): color}
+    cell_colors = {cell: cell_color
+                   for cell_color, cells in zip(RESULT_COLORS, gene_notes)
+                   for cell in cells}
+
+    # Merge cells directly below one another with the same color into
+    # [first cell, last cell, color] runs
+    runs = []
+    for cell in sorted(cell_colors):
+        cell_color = cell_colors[cell]
+
+        if runs and runs[-1][2] == cell_color and \
+                runs[-1][1] == (cell[0], cell[1] - 1):
+            runs[-1][1] = cell
+        else:
+            runs.append([cell, cell, cell_color])
+
+    for first, last, cell_color in runs:
+        commands.append(('BACKGROUND', first, last, cell_color))
+        commands.append(('TEXTCOLOR', first, last, colors.black))
+
+    return TableStyle(commands)
+
+
+def _group_table(formatted_rows, gene_notes, legend=True):
+    """
+    Lays out a run of a group's formatted genes as a table
+
+    :param formatted_rows:
+    Rows from format_group
+    :param gene_notes:
+    The [red, yellow, green] cell lists from format_group
+    :param legend:
+    Start the table with the legend row, only a group's first table has it
+    :return:
+    A Table
+    """
+
+    if legend:
+        formatted_rows = [TABLE_LEGEND] + formatted_rows
+    else:
+        # format_group counts the legend row in its cell rows
+        gene_notes = [[(column, row - 1) for column, row in cells]
+                      for cells in gene_notes]
+
+    return Table(data=tuple(formatted_rows),
+                 colWidths=(75, 60, 50, 275,),
+                 rowHeights=20,
+                 style=_table_style(gene_notes, legend))
+
+
+def _report_flowables(groups, pulled_genes, service, header, results,
+                      progress=None, profiler=None):
+    """
+    Yields the report's flowables one at a time, formatting each group only
+    when it's reached. Long groups are split into tables of TABLE_ROWS rows
+    so no more than one table's worth of genes is formatted at once.
+
+    :param groups:
+    The user defined groups
+    :param pulled_genes:
+    Genes pulled from DNA file
+    :param service:
+    23&Me or AncestryDNA?
+    :param header:
+    The top level paragraph
+    :param results:
+    The groups' result codes from classify.classify_groups
+    :param progress:
+    Optional progress.Progress, sent render events as each group is reached
+    :param profiler:
+    Optional profiling.Profiler, times the format stage
+    """
+
+    if profiler is None:
+        profiler = NullProfiler()
+
+    styles = _get_styles()
+    templates = _get_templates(header)
+
+    yield templates["logo"]  # Add the logo
+    yield templates["title"]  # Add the title
+    yield templates["header"]  # Add the header
+    yield Spacer(width=0, height=20)
+
+    #   Add Groups
+    for done, (group, genes) in enumerate(groups.items()):
+
+        if progress is not None:
+            progress.emit("render", groups_rendered=done,
+                          groups_total=len(groups))
+
+        yield copy.copy(templates["line"])
+        yield Spacer(width=0, height=5)
+
+        if len(genes) < 1:
+            continue
+
+        # Add group name
+        yield Paragraph(f"<i>{group}</i>", styles["GroupTitle"])
+
+        for start in range(0, len(genes), TABLE_ROWS):
+            end = start + TABLE_ROWS
+
+            with profiler.stage("format"):
+
+                # Get the genes as rows to be added to the document
+                formatted_rows, gene_notes = format_group(genes[start:end],
+                                                          service,
+                                                          pulled_genes,
+                                                          results[group][
+                                                              start:end],
+                                                          progress)
+
+                group_table = _group_table(formatted_rows, gene_notes,
+                                           legend=start == 0)
+
+            yield group_table
+
+        yield Spacer(width=0, height=20)
+
+    if progress is not None:
+        progress.emit("render", groups_rendered=len(groups),
+                      groups_total=len(groups))
+
+
+class _FlowableStream(list):
+    """
+    A list of flowables that refills itself from an iterator as doc.build
+    takes flowables off the front, so only a few are held at a time and
+    each is freed once drawn
+    """
+
+    def __init__(self, flowables, lookahead=32):
+        """
+        :param flowables:
+        Iterator of flowables
+        :param lookahead:
+        Flowables to keep queued, enough for keepWithNext to look ahead
+        """
+
+        super(_FlowableStream, self).__init__()
+        self._flowables = iter(flowables)
+        self._lookahead = lookahead
+
+    def _fill(self):
+        while self._flowables is not None and \
+                super(_FlowableStream, self).__len__() < self._lookahead:
+            try:
+                self.append(next(self._flowables))
+            except StopIteration:
+                self._flowables = None
+
+    def __len__(self):
+        self._fill()
+        return super(_FlowableStream, self).__len__()
+
+    def __getitem__(self, index):
+        self._fill()
+        return super(_FlowableStream, self).__getitem__(index)
+
+
 def write_report(groups, pulled_genes, filename, out_path, service,
-                 header):
+                 header, progress=None, profiler=None, stream=True,
+                 results=None):
     """
     Creates the pdf file
 
@@ -191,12 +461,29 @@ def write_report(groups, pulled_genes, filename, out_path, service,
     :param header:
     The top level paragraph
 
+    :param progress:
+    Optional progress.Progress, sent render events as each group is laid
+    out and a build event once the PDF is written
+
+    :param profiler:
+    Optional profiling.Profiler, times the classify, format and build stages
+
+    :param stream:
+    Format groups as the PDF is built rather than all up front, keeping
+    memory flat however large the panel
+
+    :param results:
+    The groups' result codes from classify.classify_groups, classified here
+    if not given
+
     :return:
     Path of created file
     """
 
+    if profiler is None:
+        profiler = NullProfiler()
+
     # Set up
-    styles = getSampleStyleSheet()
     doc = SimpleDocTemplate(f"{out_path}/{filename}.pdf",
                             pagesize=letter,
                             rightMargin=72,
@@ -204,69 +491,36 @@ def write_report(groups, pulled_genes, filename, out_path, service,
                             topMargin=72,
                             bottomMargin=18)
 
-    # Declarations
-    elements = []
-    title = "Empowered Genetics Variant Report"
-    logo = "PersistentData/eg.jpg"
-
-    elements.append(Image(logo, 1.5*inch, 1.5*inch))  # Add the logo
-    elements.append(Paragraph(f"<font color=#5A8782>{title}</font>",
-                              styles["h1"]))  # Add the title
-    elements.append(Paragraph(header, styles["df"]))  # Add the header
-    elements.append(Spacer(width=0, height=20))
-
-    #   Add Groups
-    for group, genes in groups.items():
-
-        elements.append(MCLine(500))
-        elements.append(Spacer(width=0, height=5))
-
-        # Get the group as a tuple to be added to the document
-        formatted_group, gene_notes = format_group(genes,
-                                                   service,
-                                                   pulled_genes)
-
-        if len(formatted_group) < 1:
-            continue
-
-        # Add group name
-        elements.append(Paragraph(f"<font color=#516170><i>{group}</i></font>",
-                                  styles["h2"]))
-
-        # Nested tuple for table: main tuple is table, inner tuples rows, each
-        # item in its own column
-        table_legend = [("Gene", "RS#", "Wild/Var", "Result",), ]
-        group_data = tuple(table_legend + formatted_group)
-
-        group_table = Table(data=group_data,
-                            colWidths=(75, 60, 50, 275,),
-                            rowHeights=20)
-
-        # Highlight the cells accordingly
-        for index, color in enumerate(gene_notes):
-            for cell in color:
-                if index == 0:
-                    cell_color = colors.red
-                elif index == 1:
-                    cell_color = colors.yellow
-                else:
-                    cell_color = colors.green
-
-                group_table.setStyle(TableStyle([('BACKGROUND', cell, cell,
-                                                  cell_color),
-                                                 ('TEXTCOLOR', cell, cell,
-                                                  colors.black)]))
-
-        elements.append(group_table)
-        elements.append(Spacer(width=0, height=20))
+    # Classify every group's genes in one pass
+    if results is None:
+        with profiler.stage("classify"):
+            results = classify.classify_groups(groups, service,
+                                               pulled_genes)
+
+    if stream:
+        # Formatting runs inside the build stage, it's timed as its own
+        elements = _FlowableStream(_report_flowables(groups, pulled_genes,
+                                                     service, header,
+                                                     results, progress,
+                                                     profiler))
+    else:
+        elements = list(_report_flowables(groups, pulled_genes, service,
+                                          header, results, progress,
+                                          profiler))
 
     # Build the elements
-    doc.build(elements)
+    with profiler.stage("build"):
+        doc.build(elements)
+
+    if progress is not None:
+        progress.emit("build", pages=doc.page)
 
     return f"{out_path}/report.pdf"
 
 
-def generate(dna_path, header, filename, output_path, loading_bar):
+def generate(dna_path, header, filename, output_path, loading_bar=None,
+             groups=None, use_cache=False, cancel=None, progress_log=None,
+             profile=False, cprofile=False, export_path=None):
     """
     Pulls together numerous functions to generate the pdf report
 
@@ -282,35 +536,195 @@ def generate(dna_path, header, filename, output_path, loading_bar):
     :param output_path:
     Destination for the report
 
+    :param loading_bar:
+    Progress bar, its value is set as the report is built. Leave out when
+    running without the GUI.
+
+    :param groups:
+    The groups to report on, loaded from disk if not given
+
+    :param use_cache:
+    Look genes up in the DNA file's genotype cache, indexing it if needed.
+    Off by default, indexing a file is much slower than one scan of it, so
+    it only pays off for files reported on again.
+
+    :param cancel:
+    Optional threading.Event, generate() raises ReportCancelled at the next
+    progress event once it is set
+
+    :param progress_log:
+    Optional path of a file to append every progress event to, as JSON lines
+
+    :param profile:
+    Record wall time, CPU time and peak memory for each stage, saved in
+    PersistentData/timings
+
+    :param cprofile:
+    Also save cProfile stats for the run, implies profile
+
+    :param export_path:
+    Optional dataset file to append the genotypes and results to, see
+    export.py
+
     :return:
     The path to the generated report
     """
 
-    # Get the predefined groups
-    groups = group_mngr.load_groups()
+    file_paths = generate_many(dna_path, header, {filename: groups},
+                               output_path, loading_bar, use_cache, cancel,
+                               progress_log, profile, cprofile, export_path)
+
+    return file_paths[filename]
+
+
+def generate_many(dna_path, header, reports, output_path, loading_bar=None,
+                  use_cache=False, cancel=None, progress_log=None,
+                  profile=False, cprofile=False, export_path=None):
+    """
+    Generates several reports from one DNA file, e.g. the variants of a
+    multi-report order. The file is detected and scanned once, against the
+    RS ids of every report's groups.
+
+    :param dna_path:
+    Path to the DNA file
+
+    :param header:
+    Paragraph at the top of each document
+
+    :param reports:
+    {'Report name': <groups dictionary>, }, a report's groups are loaded
+    from disk if they're None
+
+    :param output_path:
+    Destination for the reports
+
+    :param loading_bar:
+    Progress bar, see generate()
+
+    :param use_cache:
+    Look genes up in the DNA file's genotype cache, see generate()
+
+    :param cancel:
+    Optional threading.Event, see generate()
+
+    :param progress_log:
+    Optional path of a file to append every progress event to, as JSON lines
+
+    :param profile:
+    Record each stage's timings, see generate()
+
+    :param cprofile:
+    Also save cProfile stats for the run, implies profile
+
+    :param export_path:
+    Optional dataset file to append each report's genotypes and results to
+
+    :return:
+    {'Report name': <path to the generated report>, }
+    """
+
+    if loading_bar is None:
+        loading_bar = NullProgress()
+
+    def check_cancel(event):
+        if cancel is not None and cancel.is_set():
+            raise ReportCancelled()
+
+    report_progress = Progress(check_cancel, BarSink(loading_bar))
+    run_name = "+".join(reports)
+
+    if progress_log is not None:
+        log_sink = JsonLinesSink(progress_log, report=run_name,
+                                 dna_path=dna_path)
+        report_progress.sinks.append(log_sink)
+
+    if profile or cprofile:
+        profiler = Profiler(use_cprofile=cprofile)
+        profiler.start()
+    else:
+        profiler = NullProfiler()
+
+    file_paths = {}
+
+    try:
+        # Get the predefined groups
+        with profiler.stage("load"):
+            if any(groups is None for groups in reports.values()):
+                saved_groups = group_mngr.load_groups()
+                reports = {filename: saved_groups if groups is None else groups
+                           for filename, groups in reports.items()}
+
+        gene_count = sum(len(genes) for groups in reports.values()
+                         for genes in groups.values())
+        report_progress.emit("load", groups=sum(len(groups) for groups in
+                                                reports.values()),
+                             genes=gene_count)
+
+        # Detecting the service and parsing share one open file
+        with file_parser.DnaFile(dna_path) as dna_file:
+
+            # Create variable to hold the active service, assigned below
+            # Returns "AncestryDNA" or "23&Me"
+            with profiler.stage("detect"):
+                service = _detect_service(dna_file, report_progress)
+
+            # Get the genes from the provided file, one scan for every report
+            with profiler.stage("parse"):
+                pulled = file_parser.parse_many(reports, dna_file, service,
+                                                use_cache=use_cache,
+                                                progress=report_progress)
+
+        for filename, groups in reports.items():
+            pulled_genes = pulled[filename]
+
+            # Classify every group's genes in one pass
+            with profiler.stage("classify"):
+                results = classify.classify_groups(groups, service,
+                                                   pulled_genes)
+
+            # Create the pdf with given info
+            write_report(groups, pulled_genes, filename, output_path,
+                         service, header=header, progress=report_progress,
+                         profiler=profiler, results=results)
+
+            if export_path is not None:
+                with profiler.stage("export"):
+                    export.append(export_path, filename, groups,
+                                  pulled_genes, service, results,
+                                  dna_path=dna_path)
 
-    loading_bar.value = 10
+            # Record the path the file was saved to
+            file_paths[filename] = output_path + f"/{filename}.pdf"
 
-    # Create variable to hold the active service, assigned below
-    service = _detect_service(dna_path)  # Returns "AncestryDNA" or "23&Me"
+            report_progress.emit("done", path=file_paths[filename])
 
-    loading_bar.value = 20
+    finally:
+        if progress_log is not None:
+            log_sink.close()
 
-    # Get the genes from the provided file
-    pulled_genes = file_parser.parse(groups, dna_path, service)
+        if profile or cprofile:
+            profiler.stop()
 
-    loading_bar.value += 50
+    if profile or cprofile:
+        profiler.write(run_name, dna_path=dna_path, service=service,
+                       genes=gene_count,
+                       genes_found=sum(len(pulled_genes) for pulled_genes
+                                       in pulled.values()))
 
-    # Create the pdf with given info
-    write_report(groups, pulled_genes, filename, output_path, service,
-                 header=header)
+    return file_paths
 
-    loading_bar.value = 75
 
-    # Return the path the file was saved to
-    file_path = output_path + f"/{filename}.pdf"
+class ReportCancelled(Exception):
+    """Raised by generate() when its cancel event is set."""
+
+
+class NullProgress:
+    """
+    Progress sink for generate() when there's no progress bar to update,
+    e.g. from the command line or a worker process
+    """
 
-    return file_path
+    value = 0
 
 
 class MCLine(Flowable):
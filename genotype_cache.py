@@ -0,0 +1,321 @@
+"""
+
+Brandon Dunbar
+Genotype Cache
+Keeps an on-disk index of every genotype in previously parsed DNA files
+
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+
+import region_index
+from logger import FileLock
+
+CACHE_DIR = "PersistentData/genotype_cache"
+MANIFEST = f"{CACHE_DIR}/manifest.json"
+MAX_CACHE_BYTES = 512 * 1024 * 1024
+
+# SQLite's default limit on parameters in a single query is 999
+_QUERY_CHUNK = 900
+
+# {(absolute path, size, mtime): digest}, files hashed by this process, so a
+# fetch that misses and the store after it hash the file once
+_digests = {}
+
+
+def _file_key(dna_path):
+    """
+    The stat signature of a DNA file, used to skip rehashing files that
+    haven't changed since they were indexed
+
+    :param dna_path:
+    Path to the DNA file
+    :return:
+    [absolute path, size, mtime in nanoseconds]
+    """
+
+    stat = os.stat(dna_path)
+    return [os.path.abspath(dna_path), stat.st_size, stat.st_mtime_ns]
+
+
+def _hash_file(dna_path):
+    """
+    Hashes the contents of a DNA file
+
+    :param dna_path:
+    Path to the DNA file
+    :return:
+    Hex digest of the file
+    """
+
+    digest = hashlib.sha1()
+
+    with open(dna_path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def _load_manifest():
+    """
+    Loads the cache manifest, which records each index's size and last use,
+    and the stat signature each known DNA path had when it was hashed
+
+    :return:
+    Manifest dictionary
+    """
+
+    try:
+        with open(MANIFEST, "r") as file:
+            return json.load(file)
+
+    except (OSError, ValueError):  # Missing or unreadable, start over
+        return {"indexes": {}, "paths": {}}
+
+
+def _save_manifest(manifest):
+    """
+    Writes the manifest to a temporary file and swaps it in, so a crash
+    mid-write never leaves a half written manifest
+
+    :param manifest:
+    Manifest dictionary
+    """
+
+    temp_path = f"{MANIFEST}.{os.getpid()}.tmp"
+
+    with open(temp_path, "w") as file:
+        json.dump(manifest, file)
+
+    os.replace(temp_path, MANIFEST)
+
+
+@contextmanager
+def _locked_manifest():
+    """
+    Loads the manifest under a lock and saves it on the way out. Batch runs
+    update it from several processes at once, without the lock they'd
+    overwrite each other's changes.
+
+    :return:
+    Manifest dictionary, to update in place
+    """
+
+    with FileLock(f"{MANIFEST}.lock"):
+        manifest = _load_manifest()
+        yield manifest
+        _save_manifest(manifest)
+
+
+def _index_path(digest):
+    return f"{CACHE_DIR}/{digest}.db"
+
+
+def _digest(dna_path, manifest):
+    """
+    Finds the content hash of a DNA file, only hashing it if its size or
+    mtime changed since it was last seen
+
+    :param dna_path:
+    Path to the DNA file
+    :param manifest:
+    Manifest dictionary, updated with the file's signature
+    :return:
+    Hex digest of the file
+    """
+
+    path, size, mtime = _file_key(dna_path)
+    known = manifest["paths"].get(path)
+
+    if known and known[0] == size and known[1] == mtime:
+        return known[2]
+
+    digest = _digests.get((path, size, mtime))
+    if digest is None:
+        digest = _digests[path, size, mtime] = _hash_file(dna_path)
+
+    manifest["paths"][path] = [size, mtime, digest]
+
+    return digest
+
+
+def fetch(dna_path, needed_genes):
+    """
+    Looks up genotypes in the index of a previously parsed DNA file
+
+    :param dna_path:
+    Path to the DNA file
+    :param needed_genes:
+    The RS ids to look up
+    :return:
+    {rs#: [chromosome, position, allele1, allele2], ...} for the RS ids in
+    the file, or None if the file hasn't been indexed
+    """
+
+    if not os.path.isdir(CACHE_DIR):
+        return None
+
+    manifest = _load_manifest()
+    digest = _digest(dna_path, manifest)
+
+    if digest not in manifest["indexes"] or \
+            not os.path.exists(_index_path(digest)):
+        return None
+
+    genes = {}
+    needed_genes = list(needed_genes)
+
+    try:
+        # Read only, so an index evicted since the manifest was read isn't
+        # recreated empty
+        connection = sqlite3.connect(f"file:{_index_path(digest)}?mode=ro",
+                                     uri=True)
+    except sqlite3.Error:
+        return None
+
+    try:
+        for start in range(0, len(needed_genes), _QUERY_CHUNK):
+            chunk = needed_genes[start:start + _QUERY_CHUNK]
+            marks = ",".join("?" * len(chunk))
+
+            for row in connection.execute(
+                    f"SELECT rs_id, chromosome, position, allele1, allele2 "
+                    f"FROM genotypes WHERE rs_id IN ({marks})", chunk):
+                genes[row[0]] = list(row[1:])
+
+    except sqlite3.Error:  # Evicted by another process mid query
+        return None
+
+    finally:
+        connection.close()
+
+    path = os.path.abspath(dna_path)
+
+    with _locked_manifest() as locked:
+        if digest in locked["indexes"]:
+            locked["indexes"][digest]["last_used"] = time.time()
+            locked["paths"][path] = manifest["paths"][path]
+
+    return genes
+
+
+def store(dna_path, rows, max_bytes=MAX_CACHE_BYTES):
+    """
+    Indexes every genotype of a DNA file, then evicts the least recently
+    used indexes until the cache fits in max_bytes
+
+    :param dna_path:
+    Path to the DNA file
+    :param rows:
+    Iterable of [rs#, chromosome, position, allele1, allele2] lists
+    :param max_bytes:
+    Size cap for all indexes together
+    """
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+
+    manifest = _load_manifest()
+    digest = _digest(dna_path, manifest)
+
+    # Build under a temporary name so readers never see a partial index
+    index_path = _index_path(digest)
+    temp_path = f"{index_path}.{os.getpid()}.tmp"
+
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+
+    connection = sqlite3.connect(temp_path)
+
+    try:
+        connection.execute("PRAGMA journal_mode = OFF")
+        connection.execute("PRAGMA synchronous = OFF")
+        connection.execute("CREATE TABLE genotypes (rs_id TEXT PRIMARY KEY, "
+                           "chromosome TEXT, position TEXT, allele1 TEXT, "
+                           "allele2 TEXT) WITHOUT ROWID")
+
+        # Rows go in as they're read, so the file is never held in memory.
+        # The first row of a duplicated RS id is the one kept, as parse()
+        # does.
+        connection.executemany("INSERT OR IGNORE INTO genotypes "
+                               "VALUES (?, ?, ?, ?, ?)", rows)
+        connection.commit()
+
+    finally:
+        connection.close()
+
+    os.replace(temp_path, index_path)
+
+    path = os.path.abspath(dna_path)
+
+    with _locked_manifest() as locked:
+        locked["paths"][path] = manifest["paths"][path]
+        locked["indexes"][digest] = {"size": os.path.getsize(index_path),
+                                     "last_used": time.time()}
+        _evict(locked, max_bytes, keep=digest)
+
+
+def _evict(manifest, max_bytes, keep=None):
+    """
+    Deletes least recently used indexes until the total size fits
+
+    :param manifest:
+    Manifest dictionary, updated in place
+    :param max_bytes:
+    Size cap for all indexes together
+    :param keep:
+    Digest of an index that must not be evicted
+    """
+
+    indexes = manifest["indexes"]
+
+    # Indexes missing from the manifest, e.g. written by concurrent runs
+    # before it was locked, are counted and evicted like the rest
+    if os.path.isdir(CACHE_DIR):
+        for name in os.listdir(CACHE_DIR):
+            digest = name[:-len(".db")]
+
+            if name.endswith(".db") and digest not in indexes:
+                stat = os.stat(_index_path(digest))
+                indexes[digest] = {"size": stat.st_size,
+                                   "last_used": stat.st_mtime}
+
+    total = sum(entry["size"] for entry in indexes.values())
+
+    for digest in sorted(indexes, key=lambda key: indexes[key]["last_used"]):
+
+        if total <= max_bytes:
+            break
+
+        if digest == keep:
+            continue
+
+        total -= indexes.pop(digest)["size"]
+
+        if os.path.exists(_index_path(digest)):
+            os.remove(_index_path(digest))
+
+    # Forget paths whose index is gone, and their region indexes
+    paths = {}
+    for path, signature in manifest["paths"].items():
+        if signature[2] in indexes:
+            paths[path] = signature
+        else:
+            region_index.remove(path)
+
+    manifest["paths"] = paths
+
+
+def clear():
+    """
+    Deletes every index in the cache
+    """
+
+    if os.path.isdir(CACHE_DIR):
+        with _locked_manifest() as manifest:
+            _evict(manifest, 0)
@@ -4,26 +4,214 @@ Brandon Dunbar
 Group Manager
 Saves/Loads user defined groups
 
+Groups are kept in a SQLite database so a single gene or group can be
+changed without rewriting the rest, and each change is atomic.
+
 """
 
 import _pickle as pickle
 import os
+import sqlite3
+
+from gene import Gene, FIELDS
+
+DB_PATH = "PersistentData/groups.db"
+PICKLE_PATH = "PersistentData/serial_groups.pickle"
+
+# PRAGMA user_version of a database with the current schema
+_SCHEMA_VERSION = 1
+
+_GENE_COLUMNS = ", ".join(FIELDS)
+
+
+class GeneGroup(list):
+    """
+    A group's list of genes, with indexes to find a gene by name or RS id
+    without scanning the list. Use add(), update() and delete() to change
+    the group so the indexes stay in sync.
+    """
+
+    def __init__(self, genes=()):
+        super(GeneGroup, self).__init__(genes)
+
+        # {key: [<geneObject>, ]}, in group order, names aren't enforced
+        # to be unique
+        self._by_name = {}
+        self._by_rs_id = {}
+
+        for gene in self:
+            self._index(gene)
+
+    def _index(self, gene):
+        self._by_name.setdefault(gene.name, []).append(gene)
+        self._by_rs_id.setdefault(gene.rs_id, []).append(gene)
+
+    def _unindex(self, gene):
+        for index, key in ((self._by_name, gene.name),
+                           (self._by_rs_id, gene.rs_id)):
+            index[key].remove(gene)
+            if not index[key]:
+                del index[key]
+
+    def find(self, name):
+        """
+        Finds a gene by name
+
+        :param name:
+        Name of the gene
+        :return:
+        The first gene with that name, or None
+        """
+
+        genes = self._by_name.get(name)
+        return genes[0] if genes else None
+
+    def find_rs_id(self, rs_id):
+        """
+        Finds a gene by RS id
+
+        :param rs_id:
+        RS id of the gene
+        :return:
+        The first gene with that RS id, or None
+        """
+
+        genes = self._by_rs_id.get(rs_id)
+        return genes[0] if genes else None
+
+    def add(self, gene):
+        """
+        Adds a gene to the end of the group
+
+        :param gene:
+        The gene object
+        """
+
+        self.append(gene)
+        self._index(gene)
+
+    def update(self, name, attributes):
+        """
+        Changes a gene's attributes, which may include its name and RS id
+
+        :param name:
+        Name of the gene before the change
+        :param attributes:
+        A list of values to set the gene's attributes to
+        :return:
+        The changed gene, or None if there's no gene with that name
+        """
+
+        gene = self.find(name)
+
+        if gene is not None:
+            self._unindex(gene)
+            gene.set_attributes(attributes)
+
+            # Keep the index lists in group order, the gene may not be last
+            for key, index in ((gene.name, self._by_name),
+                               (gene.rs_id, self._by_rs_id)):
+                genes = index.setdefault(key, [])
+                genes.append(gene)
+                if len(genes) > 1:
+                    genes.sort(key=self.index)
+
+        return gene
+
+    def delete(self, name):
+        """
+        Removes a gene from the group
+
+        :param name:
+        Name of the gene
+        :return:
+        The removed gene, or None if there's no gene with that name
+        """
+
+        gene = self.find(name)
+
+        if gene is not None:
+            self._unindex(gene)
+            self.remove(gene)
+
+        return gene
+
+
+def _connect():
+    """
+    Opens the group database
+
+    :return:
+    A sqlite3 connection
+    """
+
+    connection = sqlite3.connect(DB_PATH)
+    connection.execute("PRAGMA foreign_keys = ON")
+
+    return connection
 
 
 def _make_paths():
     """
-    Creates the required directory and pickle file if they don't exist.
+    Creates the required directory and group database if they don't exist,
+    moving any groups saved by older versions in the pickle file into it.
     """
 
     # Create PersistentData directory if it doesn't exist
     if not os.path.isdir('PersistentData'):
         os.makedirs('PersistentData')
 
-    # Create pickle file if it doesn't exist
-    if not os.path.exists('PersistentData/serial_groups.pickle'):
+    connection = _connect()
+
+    try:
+        version = connection.execute("PRAGMA user_version").fetchone()[0]
+
+        if version < _SCHEMA_VERSION:
+
+            # The version is only set once everything is in, so an
+            # interrupted migration starts over on the next run
+            with connection:
+                connection.execute("CREATE TABLE IF NOT EXISTS groups "
+                                   "(name TEXT PRIMARY KEY)")
+                connection.execute(f"CREATE TABLE IF NOT EXISTS genes "
+                                   f"(id INTEGER PRIMARY KEY, "
+                                   f"group_name TEXT NOT NULL REFERENCES "
+                                   f"groups (name) ON DELETE CASCADE, "
+                                   f"{_GENE_COLUMNS})")
+                # Edits find genes by group and name
+                connection.execute("CREATE INDEX IF NOT EXISTS genes_name "
+                                   "ON genes (group_name, name)")
 
-        with open('PersistentData/serial_groups.pickle', 'wb') as pickle_out:
-            pickle.dump({}, pickle_out)
+                # One time migration from the pickle file
+                if os.path.exists(PICKLE_PATH):
+                    with open(PICKLE_PATH, "rb") as file_object:
+                        _write_groups(connection, pickle.load(file_object))
+
+                connection.execute(f"PRAGMA user_version = "
+                                   f"{_SCHEMA_VERSION}")
+
+    finally:
+        connection.close()
+
+
+def _write_groups(connection, groups):
+    """
+    Replaces every stored group with the given ones
+
+    :param connection:
+    Open connection, inside a transaction
+    :param groups:
+    The group dictionary
+    """
+
+    connection.execute("DELETE FROM groups")
+    connection.executemany("INSERT INTO groups (name) VALUES (?)",
+                           ((group,) for group in groups))
+    connection.executemany(f"INSERT INTO genes (group_name, {_GENE_COLUMNS}) "
+                           f"VALUES (?, {', '.join('?' * len(FIELDS))})",
+                           ([group] + gene.get_attributes()
+                            for group, genes in groups.items()
+                            for gene in genes))
 
 
 def load_groups():
@@ -31,27 +219,139 @@ def load_groups():
     Deserializes the group dictionary object
 
     :return:
-    Group dictionary object
+    Group dictionary object, {'Group Name': <GeneGroup>, }
     """
 
-    with open('PersistentData/serial_groups.pickle', "rb") as file_object:
-        groups = pickle.load(file_object)
-        return groups
+    connection = _connect()
+
+    try:
+        # Groups and genes come back in the order they were added
+        groups = {name: [] for (name,) in
+                  connection.execute("SELECT name FROM groups ORDER BY rowid")}
+
+        for row in connection.execute(f"SELECT group_name, {_GENE_COLUMNS} "
+                                      f"FROM genes ORDER BY id"):
+            groups[row[0]].append(Gene(row[1:]))
+
+        groups = {name: GeneGroup(genes) for name, genes in groups.items()}
+
+    finally:
+        connection.close()
+
+    return groups
 
 
 def save_groups(groups):
     """
     Takes in a group dictionary in the format:
-    {'Group Name': [['Gene Name', 'RS#', '23 Wild', '23 Var', 'Anc Wild',
-                     'Anc Var', 'Red', 'Yellow', 'Green'], ], }
+    {'Group Name': [<geneObject>, <geneObject>], }
+    and replaces everything stored with it, in one transaction. Prefer the
+    single group and gene functions below for edits.
+
     :param groups:
     The groups dictionary to be saved
     """
 
-    # Serialize
-    file_name = "PersistentData/serial_groups.pickle"
-    with open(file_name, "wb") as file_object:
-        pickle.dump(groups, file_object)
+    connection = _connect()
+
+    try:
+        with connection:
+            _write_groups(connection, groups)
+
+    finally:
+        connection.close()
+
+
+def _execute(query, parameters):
+    """
+    Runs one change to the database in its own transaction
+
+    :param query:
+    SQL statement
+    :param parameters:
+    Values for the statement's placeholders
+    """
+
+    connection = _connect()
+
+    try:
+        with connection:
+            connection.execute(query, parameters)
+
+    finally:
+        connection.close()
+
+
+def add_group(group):
+    """
+    Saves a new, empty group
+
+    :param group:
+    Name of the group
+    """
+
+    _execute("INSERT INTO groups (name) VALUES (?)", (group,))
+
+
+def delete_group(group):
+    """
+    Deletes a group and its genes
+
+    :param group:
+    Name of the group
+    """
+
+    _execute("DELETE FROM groups WHERE name = ?", (group,))
+
+
+def add_gene(group, gene):
+    """
+    Saves a new gene at the end of a group
+
+    :param group:
+    Name of the group
+    :param gene:
+    The gene object
+    """
+
+    _execute(f"INSERT INTO genes (group_name, {_GENE_COLUMNS}) "
+             f"VALUES (?, {', '.join('?' * len(FIELDS))})",
+             [group] + gene.get_attributes())
+
+
+def update_gene(group, name, gene):
+    """
+    Saves changes to a gene, which may include its name
+
+    :param group:
+    Name of the group
+    :param name:
+    Name of the gene before the changes
+    :param gene:
+    The changed gene object
+    """
+
+    assignments = ", ".join(f"{field} = ?" for field in FIELDS)
+
+    _execute(f"UPDATE genes SET {assignments} WHERE id = "
+             f"(SELECT id FROM genes WHERE group_name = ? AND name = ? "
+             f"ORDER BY id LIMIT 1)",
+             gene.get_attributes() + [group, name])
+
+
+def delete_gene(group, name):
+    """
+    Deletes a gene from a group
+
+    :param group:
+    Name of the group
+    :param name:
+    Name of the gene
+    """
+
+    _execute("DELETE FROM genes WHERE id = "
+             "(SELECT id FROM genes WHERE group_name = ? AND name = ? "
+             "ORDER BY id LIMIT 1)", (group, name))
 
 
 _make_paths()
@@ -4,18 +4,241 @@ Brandon Dunbar
 Logger
 Creates a log of activity for debugging
 
+Records are written as JSON lines by a background thread, so logging never
+waits on the disk. Writes take a lock file, so processes sharing a log
+(e.g. batch workers) don't interleave, and logs are rotated by size.
+
 """
 
+import atexit
+import json
+import os
+import queue
+import threading
 from datetime import datetime
 
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+LOG_PATH = 'PersistentData/log.txt'
+NOT_FOUND_PATH = 'PersistentData/not_founds.txt'
+
+MAX_BYTES = 5 * 1024 * 1024  # Rotate a log once it passes this size
+BACKUP_COUNT = 3  # Rotated logs to keep: log.txt.1 ... log.txt.3
+MAX_PENDING = 10000  # Records buffered before callers write them directly
+
+
+class FileLock:
+    """
+    Holds an exclusive lock on a lock file, across threads and processes.
+    Use as a context manager.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def __enter__(self):
+        self.file = open(self.path, "a")
+
+        if fcntl is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+        else:
+            self.file.seek(0)
+            msvcrt.locking(self.file.fileno(), msvcrt.LK_LOCK, 1)
+
+        return self
+
+    def __exit__(self, *args):
+        if fcntl is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+        else:
+            self.file.seek(0)
+            msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+
+        self.file.close()
+
+
+class _Log:
+    """
+    A log file with its own queue and writer thread
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._pid = None  # Process the writer thread belongs to
+        self._queue = None
+
+    def _start(self):
+        """
+        Starts the writer thread, again in any forked child since threads
+        don't survive a fork
+        """
+
+        with self._lock:
+            if self._pid != os.getpid():
+                self._queue = queue.Queue(MAX_PENDING)
+                threading.Thread(target=self._run, daemon=True).start()
+                self._pid = os.getpid()
+
+    def write(self, record):
+        """
+        Queues a record to be written
+
+        :param record:
+        Dictionary of JSON serializable values, others are stringified
+        """
+
+        line = json.dumps(record, default=str) + "\n"
+
+        if self._pid != os.getpid():
+            self._start()
+
+        try:
+            self._queue.put_nowait(line)
+
+        except queue.Full:  # The writer is behind, write it ourselves
+            self._write_quietly([line])
+
+    def flush(self):
+        """Waits until everything queued has been written."""
+
+        if self._pid == os.getpid():
+            self._queue.join()
+
+    def _run(self):
+        """
+        Writer thread: takes whatever is queued and writes it in one go
+        """
+
+        while True:
+            lines = [self._queue.get()]
+
+            while len(lines) < 1000:
+                try:
+                    lines.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            try:
+                self._write_quietly(lines)
+
+            finally:
+                for _ in lines:
+                    self._queue.task_done()
+
+    def _write_quietly(self, lines):
+        """
+        Writes lines with _write(), losing them if that fails. Logging must
+        never take the program down, or stop the writer thread and leave
+        flush() waiting forever.
+
+        :param lines:
+        List of lines to write
+        """
 
-def log(text):
+        try:
+            self._write(lines)
+
+        except Exception:
+            pass
+
+    def _write(self, lines):
+        """
+        Appends lines to the log under the lock file, rotating it first if
+        it's grown too big
+
+        :param lines:
+        List of lines to write
+        """
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        text = "".join(lines)
+
+        with FileLock(f"{self.path}.lock"):
+
+            if os.path.exists(self.path) and \
+                    os.path.getsize(self.path) + len(text) > MAX_BYTES:
+                self._rotate()
+
+            with open(self.path, "a") as file:
+                file.write(text)
+
+    def _rotate(self):
+        """
+        log.txt becomes log.txt.1, log.txt.1 becomes log.txt.2 and so on,
+        dropping the oldest
+        """
+
+        for number in range(BACKUP_COUNT - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{number}"):
+                os.replace(f"{self.path}.{number}",
+                           f"{self.path}.{number + 1}")
+
+        os.replace(self.path, f"{self.path}.1")
+
+
+_logs = {}
+_logs_lock = threading.Lock()
+
+
+def _get_log(path):
+    with _logs_lock:
+        if path not in _logs:
+            _logs[path] = _Log(path)
+
+        return _logs[path]
+
+
+def _record(**fields):
+    record = {"time": datetime.now().isoformat(), "pid": os.getpid()}
+    record.update(fields)
+
+    return record
+
+
+def log(text, **fields):
     """
     Writes text to log file
 
     :param text:
     The text to be logged.
+    :param fields:
+    Extra values to record with it
+    """
+
+    _get_log(LOG_PATH).write(_record(message=str(text), **fields))
+
+
+def log_not_found(rs_ids):
+    """
+    Records RS ids that weren't found in a DNA file
+
+    :param rs_ids:
+    A list of RS ids
     """
 
-    with open('PersistentData/log.txt', 'a') as file:
-        file.write(f"{datetime.now()}: {text}\n")
+    _get_log(NOT_FOUND_PATH).write(_record(not_found=list(rs_ids)))
+
+
+def flush():
+    """
+    Waits until every queued record has been written. Runs at exit, but
+    processes that skip exit handlers (pool workers) must call it.
+    """
+
+    with _logs_lock:
+        logs = list(_logs.values())
+
+    for _log in logs:
+        _log.flush()
+
+
+atexit.register(flush)
@@ -0,0 +1,143 @@
+"""
+
+Brandon Dunbar
+Profiling
+Times each stage of report generation, for finding out why a report is slow
+
+"""
+
+import contextlib
+import cProfile
+import json
+import os
+import time
+import tracemalloc
+from datetime import datetime
+
+TIMINGS_DIR = "PersistentData/timings"
+
+
+class Profiler:
+    """
+    Records wall time, CPU time and peak memory for each stage of a run.
+    Memory is traced with tracemalloc, which slows Python down noticeably,
+    so only profile when asked to.
+    """
+
+    def __init__(self, use_cprofile=False):
+        """
+        :param use_cprofile:
+        Also run cProfile over the whole run, saved next to the timings
+        """
+
+        self.stages = {}
+        self.cprofile = cProfile.Profile() if use_cprofile else None
+        self._started_tracing = False
+        self._open = []  # The stages currently running, innermost last
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+
+        if self.cprofile is not None:
+            self.cprofile.enable()
+
+    def stop(self):
+        if self.cprofile is not None:
+            self.cprofile.disable()
+
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """
+        Times the code in the with block as part of a stage. A stage entered
+        more than once (e.g. once per group) adds up its times and keeps its
+        highest peak. Stages may nest, e.g. formatting run while the PDF is
+        built: time in the inner stage counts towards it alone, not the one
+        around it.
+
+        :param name:
+        Name of the stage
+        """
+
+        memory, peak = tracemalloc.get_traced_memory()
+
+        if self._open:  # The peak is about to be reset, keep the outer one's
+            outer = self._open[-1]
+            outer["peak"] = max(outer["peak"], peak)
+
+        tracemalloc.reset_peak()
+
+        frame = {"memory": memory, "peak": memory,
+                 "inner_wall": 0.0, "inner_cpu": 0.0}
+        self._open.append(frame)
+
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+
+        try:
+            yield
+
+        finally:
+            wall = time.perf_counter() - start_wall
+            cpu = time.process_time() - start_cpu
+            peak = max(frame["peak"], tracemalloc.get_traced_memory()[1])
+
+            self._open.pop()
+
+            if self._open:
+                outer = self._open[-1]
+                outer["inner_wall"] += wall
+                outer["inner_cpu"] += cpu
+                outer["peak"] = max(outer["peak"], peak)
+
+            stage = self.stages.setdefault(name, {"calls": 0,
+                                                  "wall_seconds": 0.0,
+                                                  "cpu_seconds": 0.0,
+                                                  "peak_memory_bytes": 0})
+            stage["calls"] += 1
+            stage["wall_seconds"] += wall - frame["inner_wall"]
+            stage["cpu_seconds"] += cpu - frame["inner_cpu"]
+            stage["peak_memory_bytes"] = max(stage["peak_memory_bytes"],
+                                             peak - frame["memory"])
+
+    def write(self, report, **fields):
+        """
+        Saves the timings as JSON in PersistentData/timings, and the cProfile
+        stats alongside if they were collected
+
+        :param report:
+        Name of the report, used in the file names
+        :param fields:
+        Extra fields to record, e.g. the DNA file's path
+        :return:
+        Path of the timings file
+        """
+
+        os.makedirs(TIMINGS_DIR, exist_ok=True)
+
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        base_path = f"{TIMINGS_DIR}/{report}-{stamp}"
+
+        record = {"report": report, "created": datetime.now().isoformat()}
+        record.update(fields)
+        record["stages"] = self.stages
+
+        with open(f"{base_path}.json", "w") as file:
+            json.dump(record, file, indent=2)
+
+        if self.cprofile is not None:
+            self.cprofile.dump_stats(f"{base_path}.prof")
+
+        return f"{base_path}.json"
+
+
+class NullProfiler:
+    """Stands in for a Profiler when not profiling, every stage is a no-op."""
+
+    def stage(self, name):
+        return contextlib.nullcontext()
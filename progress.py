@@ -0,0 +1,103 @@
+"""
+
+Brandon Dunbar
+Progress
+Reports what the report pipeline is doing, for progress bars and logs
+
+Each stage emits events, dictionaries with a timestamp, the stage name and
+counts of the work done so far:
+load - groups, genes
+detect - bytes_read, service
+parse - bytes_read, bytes_total, lines_scanned, genes_matched
+format - genes, genes_matched
+render - groups_rendered, groups_total
+build - pages
+done - path
+
+"""
+
+import json
+import time
+
+
+class Progress:
+    """Passes pipeline events to any number of sinks."""
+
+    def __init__(self, *sinks):
+        self.sinks = list(sinks)
+
+    def emit(self, stage, **counts):
+        """
+        Sends an event to every sink
+
+        :param stage:
+        Name of the pipeline stage
+        :param counts:
+        The stage's counts
+        """
+
+        event = {"time": time.time(), "stage": stage}
+        event.update(counts)
+
+        for sink in self.sinks:
+            sink(event)
+
+
+class BarSink:
+    """
+    Moves a progress bar (anything with a value attribute, 0-100) through
+    each stage's share of the work
+    """
+
+    # {stage: (start %, end %, done count, total count)}, stages without
+    # counts are complete as soon as they're reported
+    STAGES = {"load": (0, 10, None, None),
+              "detect": (10, 20, None, None),
+              "parse": (20, 70, "bytes_read", "bytes_total"),
+              "render": (70, 95, "groups_rendered", "groups_total"),
+              "build": (95, 95, None, None)}
+
+    def __init__(self, loading_bar):
+        self.loading_bar = loading_bar
+
+    def __call__(self, event):
+
+        try:
+            start, end, done, total = self.STAGES[event["stage"]]
+        except KeyError:
+            return
+
+        if done is None:
+            fraction = 1
+        else:
+            fraction = event[done] / max(event[total], 1)
+
+        self.loading_bar.value = start + (end - start) * fraction
+
+
+class JsonLinesSink:
+    """
+    Writes each event as a line of JSON, for following batch runs from other
+    tools. Call close() when the report is done.
+    """
+
+    def __init__(self, path, **fields):
+        """
+        :param path:
+        File to append the events to
+        :param fields:
+        Extra fields added to every event, e.g. report="name"
+        """
+
+        self.fields = fields
+        self.file = open(path, "a")
+
+    def __call__(self, event):
+        record = dict(self.fields)
+        record.update(event)
+
+        self.file.write(json.dumps(record) + "\n")
+        self.file.flush()  # Readers follow the file as it grows
+
+    def close(self):
+        self.file.close()
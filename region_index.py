@@ -0,0 +1,293 @@
+"""
+
+Brandon Dunbar
+Region Index
+Finds the rows of a DNA file in a chromosome region without a full scan
+
+An index records, for each chromosome, the position and byte offset of the
+first row of every block of BLOCK_LINES rows. A region query seeks to the
+block before the region's start and reads on until it passes the end.
+DNA files list each chromosome's rows together, sorted by position. Files
+that don't are recorded as unsorted and always scanned in full.
+
+Indexes are built during the first full pass over a file, see
+file_parser.parse_regions(), and kept in PersistentData/region_index, one
+per file path. Each records the file's size and modification time, so an
+index of a file that has changed is ignored and then replaced. An index is
+deleted with its file's genotype cache index, and the least recently used
+go once they pass MAX_INDEX_BYTES together.
+
+"""
+
+import hashlib
+import json
+import os
+import struct
+from array import array
+from bisect import bisect_left
+
+INDEX_DIR = "PersistentData/region_index"
+BLOCK_LINES = 256
+MAX_INDEX_BYTES = 64 * 1024 * 1024
+
+MAGIC = b"EGR2"
+_HEADER = struct.Struct("<4sI")
+
+
+def _index_path(dna_path):
+    """
+    Where a DNA file's index is kept, named for the file's path so a new
+    index replaces the old one
+
+    :param dna_path:
+    Path to the DNA file
+    :return:
+    Path of the index file
+    """
+
+    key = os.path.abspath(dna_path).encode()
+
+    return f"{INDEX_DIR}/{hashlib.sha1(key).hexdigest()}.idx"
+
+
+def _signature(dna_path):
+    """
+    :return:
+    [size, mtime in nanoseconds] of the DNA file, an index only matches
+    the file while these are unchanged
+    """
+
+    stat = os.stat(dna_path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+class RegionIndex:
+    """
+    Block positions and offsets per chromosome, built a row at a time with
+    add() while scanning a file from its start
+    """
+
+    def __init__(self, blocks=None, is_sorted=True):
+        """
+        :param blocks:
+        {chromosome: (positions array, offsets array)}
+        :param is_sorted:
+        False if the file's rows aren't grouped by chromosome and sorted
+        by position, the index can't be used then
+        """
+
+        self.blocks = {} if blocks is None else blocks
+        self.sorted = is_sorted
+
+        self._chromosome = None
+        self._rows = 0
+        self._last_position = 0
+
+    def add(self, chromosome, position, offset):
+        """
+        Records a row, in file order
+
+        :param chromosome:
+        The row's chromosome, as written in the file
+        :param position:
+        The row's position
+        :param offset:
+        Byte offset of the row's line in the (decompressed) file
+        """
+
+        if not self.sorted:
+            return
+
+        try:
+            position = int(position)
+        except ValueError:
+            self.sorted = False
+            return
+
+        if chromosome != self._chromosome:
+
+            if chromosome in self.blocks:  # Seen before, rows aren't grouped
+                self.sorted = False
+                return
+
+            self.blocks[chromosome] = (array("q"), array("q"))
+            self._chromosome = chromosome
+            self._rows = 0
+
+        elif position < self._last_position:
+            self.sorted = False
+            return
+
+        if not self._rows % BLOCK_LINES:
+            positions, offsets = self.blocks[chromosome]
+            positions.append(position)
+            offsets.append(offset)
+
+        self._rows += 1
+        self._last_position = position
+
+    def seek_offset(self, chromosome, start):
+        """
+        Finds where to start reading for a region
+
+        :param chromosome:
+        The region's chromosome
+        :param start:
+        The region's first position
+        :return:
+        Byte offset of the block holding the first row at or after start,
+        or None if the chromosome isn't in the file
+        """
+
+        if chromosome not in self.blocks:
+            return None
+
+        positions, offsets = self.blocks[chromosome]
+
+        # The block before the first block starting at or after start, rows
+        # at start may be at the end of it
+        block = max(bisect_left(positions, start) - 1, 0)
+
+        return offsets[block]
+
+    def save(self, dna_path):
+        """
+        Writes the index to disk for the DNA file
+
+        :param dna_path:
+        Path to the DNA file the index was built from
+        """
+
+        os.makedirs(INDEX_DIR, exist_ok=True)
+
+        blocks = self.blocks if self.sorted else {}
+        header = json.dumps({"signature": _signature(dna_path),
+                             "sorted": self.sorted,
+                             "block_lines": BLOCK_LINES,
+                             "chromosomes": [[chromosome, len(positions)]
+                                             for chromosome, (positions, _)
+                                             in blocks.items()]}).encode()
+
+        path = _index_path(dna_path)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+
+        # Swapped in whole so readers never see a half written index
+        with open(temp_path, "wb") as file:
+            file.write(_HEADER.pack(MAGIC, len(header)))
+            file.write(header)
+
+            for positions, offsets in blocks.values():
+                file.write(positions.tobytes())
+                file.write(offsets.tobytes())
+
+        os.replace(temp_path, path)
+        _evict(MAX_INDEX_BYTES, keep=path)
+
+
+def load(dna_path):
+    """
+    Loads the index of a DNA file
+
+    :param dna_path:
+    Path to the DNA file
+    :return:
+    The RegionIndex, or None if the file hasn't been indexed since it last
+    changed
+    """
+
+    path = _index_path(dna_path)
+
+    try:
+        with open(path, "rb") as file:
+            magic, header_size = _HEADER.unpack(file.read(_HEADER.size))
+
+            if magic != MAGIC:
+                return None
+
+            header = json.loads(file.read(header_size))
+
+            if header["signature"] != _signature(dna_path):
+                return None  # The file changed since it was indexed
+
+            blocks = {}
+            for chromosome, count in header["chromosomes"]:
+                positions, offsets = array("q"), array("q")
+                positions.fromfile(file, count)
+                offsets.fromfile(file, count)
+                blocks[chromosome] = (positions, offsets)
+
+    except (OSError, EOFError, ValueError, KeyError, struct.error):
+        return None  # Missing or unreadable, it'll be rebuilt
+
+    try:
+        os.utime(path)  # Marks it used, for _evict()
+    except OSError:
+        pass
+
+    return RegionIndex(blocks, header["sorted"])
+
+
+def remove(dna_path):
+    """
+    Deletes the index of a DNA file, if it has one
+
+    :param dna_path:
+    Path to the DNA file, it needn't exist any more
+    """
+
+    try:
+        os.remove(_index_path(dna_path))
+    except FileNotFoundError:
+        pass
+
+
+def _evict(max_bytes, keep=None):
+    """
+    Deletes the least recently used indexes until they fit in max_bytes
+
+    :param max_bytes:
+    Size cap for all indexes together
+    :param keep:
+    Path of an index that must not be deleted
+    """
+
+    indexes = []
+    for name in os.listdir(INDEX_DIR):
+        if not name.endswith(".idx"):  # Another process' index mid write
+            continue
+
+        path = os.path.join(INDEX_DIR, name)
+
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:  # Deleted by another process
+            continue
+
+        indexes.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in indexes)
+
+    for _, size, path in sorted(indexes):
+
+        if total <= max_bytes:
+            break
+
+        if path == keep:
+            continue
+
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+        total -= size
+
+
+def clear():
+    """
+    Deletes every region index
+    """
+
+    if os.path.isdir(INDEX_DIR):
+        for name in os.listdir(INDEX_DIR):
+            os.remove(os.path.join(INDEX_DIR, name))
@@ -0,0 +1,113 @@
+"""
+
+Test helpers
+Synthetic DNA files and throwaway working directories, shared by the tests
+and benchmark.py
+
+"""
+
+import contextlib
+import os
+import tempfile
+import unittest
+
+BASES = "ACGT"
+
+
+def _genotype(i):
+    """
+    The default alleles of row i, varied but repeatable
+    """
+
+    return BASES[i % 4], BASES[i * 7 % 4]
+
+
+def dna_rows(lines, chromosomes=22, spacing=100, genotype=_genotype):
+    """
+    Rows for RS ids rs1 through rs<lines>, grouped by chromosome and sorted
+    by position as vendors write them
+
+    :param lines:
+    Number of rows
+    :param chromosomes:
+    Number of chromosomes the rows are spread over, in order
+    :param spacing:
+    Distance between the positions of consecutive rows
+    :param genotype:
+    Function giving the (allele1, allele2) of a row from its number, "-"
+    for a no call
+    :return:
+    A generator of [rs#, chromosome, position, allele1, allele2] lists
+    """
+
+    for i in range(1, lines + 1):
+        one, two = genotype(i)
+        yield [f"rs{i}", str(i * chromosomes // (lines + 1) + 1),
+               str(i * spacing), one, two]
+
+
+def write_dna_file(path, lines, service="AncestryDNA", **layout):
+    """
+    Writes a synthetic raw DNA file of dna_rows()
+
+    :param path:
+    Where to write the file
+    :param lines:
+    Number of SNP rows to write
+    :param service:
+    AncestryDNA or 23&Me layout
+    :param layout:
+    chromosomes, spacing and genotype, passed to dna_rows()
+    """
+
+    with open(path, "w") as file:
+
+        if service == "AncestryDNA":
+            file.write("#AncestryDNA raw data download\n")
+            file.write("rsid\tchromosome\tposition\tallele1\tallele2\n")
+
+            for row in dna_rows(lines, **layout):
+                file.write("\t".join(row) + "\n")
+
+        else:
+            file.write("# This data file generated by 23andMe\n")
+            file.write("# rsid\tchromosome\tposition\tgenotype\n")
+
+            for rs_id, chromosome, position, one, two in \
+                    dna_rows(lines, **layout):
+                file.write(f"{rs_id}\t{chromosome}\t{position}\t{one}{two}\n")
+
+
+@contextlib.contextmanager
+def working_directory():
+    """
+    Runs the block in a new temporary directory, so PersistentData (the
+    genotype cache, region indexes, logs) never touches the real one
+
+    :return:
+    Path of the directory
+    """
+
+    working_dir = os.getcwd()
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+
+        try:
+            yield directory
+        finally:
+            os.chdir(working_dir)
+
+
+class WorkingDirectoryTest(unittest.TestCase):
+    """
+    Runs each test in its own working_directory(). self.working_dir is the
+    directory the tests were started from.
+    """
+
+    def setUp(self):
+        self.working_dir = os.getcwd()
+
+        context = working_directory()
+        self.directory = context.__enter__()
+        self.addCleanup(context.__exit__, None, None, None)
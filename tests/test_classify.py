@@ -0,0 +1,84 @@
+"""
+
+Classifier tests
+Checks the NumPy and plain Python passes give the same codes, in the same
+type
+
+"""
+
+import unittest
+from array import array
+from unittest import mock
+
+import classify
+from gene import Gene
+
+
+def _panel():
+    """
+    A gene of every result, for both services, repeated so positions run
+    past what an int8 holds
+
+    :return:
+    (genes, pulled_genes, expected codes)
+    """
+
+    genes = []
+    pulled_genes = {}
+    expected = []
+
+    cases = ((("A", "A"), classify.GREEN), (("g", "G"), classify.RED),
+             (("A", "G"), classify.YELLOW), (None, classify.NOT_FOUND))
+
+    for i in range(100):
+        alleles, result = cases[i % len(cases)]
+        rs_id = f"rs{i}"
+
+        genes.append(Gene([f"Gene{i}", rs_id, "A", "G", "A", "G", "Red",
+                           "Yellow", "Green"]))
+        if alleles is not None:
+            pulled_genes[rs_id] = ["1", str(i), *alleles]
+        expected.append(result)
+
+    return genes, pulled_genes, expected
+
+
+class ClassifyTest(unittest.TestCase):
+
+    def _check(self):
+        genes, pulled_genes, expected = _panel()
+
+        for service in ("AncestryDNA", "23&Me"):
+            results = classify.classify(genes, service, pulled_genes)
+
+            self.assertIsInstance(results, array)
+            self.assertEqual(results.typecode, "b")
+            self.assertEqual(list(results), expected)
+
+            # Codes are used as offsets into count arrays
+            self.assertEqual([index * 4 + result
+                              for index, result in enumerate(results)],
+                             [index * 4 + result
+                              for index, result in enumerate(expected)])
+
+    def test_python(self):
+        with mock.patch.object(classify, "numpy", None):
+            self._check()
+
+    @unittest.skipIf(classify.numpy is None, "NumPy isn't installed")
+    def test_numpy(self):
+        self._check()
+
+    def test_groups(self):
+        genes, pulled_genes, expected = _panel()
+        grouped = classify.classify_groups({"One": genes[:60],
+                                            "Two": genes[60:]},
+                                           "AncestryDNA", pulled_genes)
+
+        self.assertEqual(list(grouped["One"]) + list(grouped["Two"]),
+                         expected)
+        self.assertEqual(grouped["Two"].typecode, "b")
+
+
+if __name__ == '__main__':
+    unittest.main()
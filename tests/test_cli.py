@@ -0,0 +1,86 @@
+"""
+
+Command line tests
+Runs cli.main() on a synthetic DNA file, and on paths it can't use
+
+"""
+
+import contextlib
+import io
+import os
+import unittest
+
+import cli
+import group_mngr
+from gene import Gene
+from tests.helpers import WorkingDirectoryTest, write_dna_file
+
+try:
+    from PIL import Image
+except ImportError:  # Comes with ReportLab's image support
+    Image = None
+
+
+@unittest.skipIf(Image is None, "Pillow isn't installed")
+class CliTest(WorkingDirectoryTest):
+
+    def setUp(self):
+        super().setUp()
+
+        group_mngr._make_paths()
+        Image.new("RGB", (64, 64)).save("PersistentData/eg.jpg")
+        group_mngr.save_groups({"Test": [Gene(["Gene1", "rs1", "A", "G",
+                                               "A", "G", "Red", "Yellow",
+                                               "Green"])]})
+
+        write_dna_file("dna.txt", 100)
+
+    def _main(self, *argv):
+        """
+        :return:
+        (exit code, stdout, stderr)
+        """
+
+        stdout, stderr = io.StringIO(), io.StringIO()
+
+        with contextlib.redirect_stdout(stdout), \
+                contextlib.redirect_stderr(stderr):
+            code = cli.main(list(argv))
+
+        return code, stdout.getvalue(), stderr.getvalue()
+
+    def test_creates_output_folder(self):
+        code, stdout, stderr = self._main("dna.txt", "-o", "reports/new")
+
+        self.assertEqual(code, 0, stderr)
+        self.assertEqual(stdout.strip(), "reports/new/dna.pdf")
+        self.assertTrue(os.path.isfile("reports/new/dna.pdf"))
+
+    def test_missing_dna_file(self):
+        code, stdout, stderr = self._main("missing.txt", "-o", "reports")
+
+        self.assertEqual(code, 1)
+        self.assertEqual(len(stderr.splitlines()), 1)
+        self.assertIn("missing.txt", stderr)
+
+    def test_output_is_a_file(self):
+        with open("reports", "w"):
+            pass
+
+        code, stdout, stderr = self._main("dna.txt", "-o", "reports")
+
+        self.assertEqual(code, 1)
+        self.assertEqual(len(stderr.splitlines()), 1)
+
+    def test_invalid_file(self):
+        with open("invalid.txt", "w") as file:
+            file.write("not a DNA file\n")
+
+        code, stdout, stderr = self._main("invalid.txt", "-o", "reports")
+
+        self.assertEqual(code, 1)
+        self.assertIn("not recognized", stderr)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+"""
+
+Cohort tests
+Counts a small cohort of synthetic DNA files and checks the totals against
+classifying each file on its own
+
+"""
+
+import csv
+import json
+import os
+import unittest
+from unittest import mock
+
+import classify
+import cohort
+from gene import Gene
+from tests.helpers import BASES, WorkingDirectoryTest, write_dna_file
+
+FILES = 6
+LINES = 300
+GENES = 120  # Past what an int8 offset can hold
+
+
+def _write_dna_file(path, seed, service):
+    """
+    Writes a DNA file whose genotypes vary with the seed. 23andMe files have
+    a no call at every 50th RS id.
+    """
+
+    def genotype(i):
+        if service == "23&Me" and not i % 50:
+            return "-", "-"
+
+        return BASES[(i + seed) % 4], BASES[(i * seed) % 4]
+
+    write_dna_file(path, LINES, service, genotype=genotype)
+
+
+class CohortTest(WorkingDirectoryTest):
+
+    def setUp(self):
+        super().setUp()
+
+        os.makedirs("dna")
+        for seed in range(FILES):
+            _write_dna_file(f"dna/person{seed}.txt", seed + 1,
+                            "AncestryDNA" if seed % 2 else "23&Me")
+
+        with open("dna/invalid.txt", "w") as file:
+            file.write("not a DNA file\n")
+
+        # Some RS ids aren't in the files, some genes share one
+        self.groups = {"One": [], "Two": []}
+        for i in range(GENES):
+            rs_id = f"rs{i * 3 % (LINES + 40) + 1}"
+            self.groups["One" if i % 3 else "Two"].append(
+                Gene([f"Gene{i}", rs_id, "A", "G", "A", "G", "Red",
+                      "Yellow", "Green"]))
+
+    def _check(self, processes):
+        panel, tally = cohort.run_cohort(["dna"], self.groups, processes)
+
+        self.assertEqual(tally.files, FILES)
+        self.assertEqual(tally.services, {"AncestryDNA": FILES // 2,
+                                          "23&Me": FILES // 2})
+        self.assertEqual([path for path, error in tally.failed],
+                         [os.path.join("dna", "invalid.txt")])
+
+        # Against each file classified alone
+        expected = cohort.Tally(panel)
+        for seed in range(FILES):
+            expected.add_file(panel, f"dna/person{seed}.txt")
+
+        self.assertEqual(tally.results, expected.results)
+        self.assertEqual(tally.genotypes, expected.genotypes)
+
+        width = len(classify.RESULT_NAMES)
+        for index in range(len(panel.genes)):
+            self.assertEqual(sum(tally.results[index * width:
+                                               (index + 1) * width]), FILES)
+
+        csv_path = cohort.write_summary(panel, tally, "summary")
+        with open(csv_path) as file:
+            rows = list(csv.DictReader(file))
+
+        self.assertEqual(len(rows), GENES)
+        for row in rows:
+            self.assertEqual(int(row["found"]) + int(row["not_found"]),
+                             FILES)
+
+            # The 23andMe files have no call at every 50th RS id
+            no_calls = 0 if int(row["rs_id"][2:]) % 50 else FILES // 2
+            self.assertEqual(int(row["No call"]), no_calls)
+
+        with open(os.path.join("summary", cohort.SUMMARY_JSON)) as file:
+            self.assertEqual(json.load(file)["files"], FILES)
+
+    def test_python(self):
+        with mock.patch.object(classify, "numpy", None):
+            self._check(processes=1)
+
+    @unittest.skipIf(classify.numpy is None, "NumPy isn't installed")
+    def test_numpy(self):
+        self._check(processes=1)
+
+    def test_processes(self):
+        self._check(processes=3)
+
+
+if __name__ == '__main__':
+    unittest.main()
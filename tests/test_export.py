@@ -0,0 +1,170 @@
+"""
+
+Export tests
+Appends people parsed from synthetic DNA files to a dataset and checks
+every column read back against the rows the files were written from
+
+"""
+
+import os
+import unittest
+from collections import Counter
+
+import classify
+import export
+import file_parser
+from gene import Gene
+from tests.helpers import BASES, WorkingDirectoryTest, dna_rows, \
+    write_dna_file
+
+LINES = 500
+
+# (person, service, genotype of row i)
+PEOPLE = (("Alice", "AncestryDNA", lambda i: (BASES[i % 4], BASES[i * 7 % 4])),
+          ("Bob", "23&Me", lambda i: (BASES[i * 3 % 4], BASES[(i + 1) % 4])),
+          ("Carol", "AncestryDNA", lambda i: ("G", "G") if i % 5 else
+           ("-", "-")))
+
+
+def _expected_result(row):
+    if row is None:
+        return classify.NOT_FOUND
+    if row[3:] == ["A", "A"]:
+        return classify.GREEN
+    if row[3:] == ["G", "G"]:
+        return classify.RED
+    return classify.YELLOW
+
+
+class ExportTest(WorkingDirectoryTest):
+
+    def setUp(self):
+        super().setUp()
+
+        self.path = "dataset.egx"
+
+        # Both groups have a gene missing from the files
+        self.groups = {name: [Gene([f"Gene{i}", f"rs{i}", "A", "G", "A", "G",
+                                    "Red", "Yellow", "Green"])
+                              for i in numbers]
+                       for name, numbers in (("Cardio", [*range(1, 60), 9999]),
+                                             ("Vitamins", [9998, 250, 7]))}
+
+        # {person: {rs#: [rs#, chromosome, position, allele1, allele2]}}
+        self.rows = {}
+        self.sizes = []  # Of the dataset after each append
+
+        for person, service, genotype in PEOPLE:
+            dna_path = f"{person}.txt"
+            write_dna_file(dna_path, LINES, service, genotype=genotype)
+
+            self.rows[person] = {row[0]: row for row in
+                                 dna_rows(LINES, genotype=genotype)}
+
+            pulled_genes = file_parser.parse(self.groups, dna_path)
+            export.append(self.path, person, self.groups, pulled_genes,
+                          service, dna_path=dna_path)
+            self.sizes.append(os.path.getsize(self.path))
+
+    def _expected(self, person):
+        """
+        The person's columns, from the rows their file was written from
+        """
+
+        columns = {name: [] for name, kind in export.COLUMNS}
+
+        for group, genes in self.groups.items():
+            for gene in genes:
+                row = self.rows[person].get(gene.rs_id)
+                chromosome, position, one, two = \
+                    row[1:] if row else ["", "-1", "", ""]
+
+                columns["group"].append(group)
+                columns["gene"].append(gene.name)
+                columns["rs_id"].append(gene.rs_id)
+                columns["chromosome"].append(chromosome)
+                columns["position"].append(int(position))
+                columns["allele_one"].append(one)
+                columns["allele_two"].append(two)
+                columns["result"].append(_expected_result(row))
+
+        return columns
+
+    def test_round_trip(self):
+        row_groups = list(export.read(self.path))
+        self.assertEqual(len(row_groups), len(PEOPLE))
+
+        for (header, values), (person, service, _) in zip(row_groups, PEOPLE):
+            with self.subTest(person=person):
+                self.assertEqual(header["person"], person)
+                self.assertEqual(header["service"], service)
+                self.assertEqual(header["dna_path"], f"{person}.txt")
+
+                self.assertEqual({name: list(column) for name, column
+                                  in values.items()}, self._expected(person))
+
+    def test_reads_columns_and_people(self):
+        row_groups = list(export.read(self.path, ("rs_id", "result"),
+                                      {"Bob"}))
+
+        self.assertEqual(len(row_groups), 1)
+        header, values = row_groups[0]
+        expected = self._expected("Bob")
+
+        self.assertEqual(header["person"], "Bob")
+        self.assertEqual(sorted(values), ["result", "rs_id"])
+        self.assertEqual(values["rs_id"], expected["rs_id"])
+        self.assertEqual(list(values["result"]), expected["result"])
+
+    def test_counts(self):
+        results = Counter()
+        genotypes = {}
+
+        for person, service, genotype in PEOPLE:
+            expected = self._expected(person)
+            results.update((group, classify.RESULT_NAMES[result])
+                           for group, result in zip(expected["group"],
+                                                    expected["result"]))
+
+            for rs_id, one, two in zip(expected["rs_id"],
+                                       expected["allele_one"],
+                                       expected["allele_two"]):
+                if one:
+                    genotypes.setdefault(rs_id, Counter())[f"{one}/{two}"] += 1
+
+        self.assertEqual(export.result_counts(self.path), results)
+        self.assertEqual(export.genotype_counts(self.path), genotypes)
+        self.assertEqual(export.genotype_counts(self.path, {"rs7"}),
+                         {"rs7": genotypes["rs7"]})
+
+    def test_ignores_cut_short_append(self):
+        # Within the last row group's columns, JSON header and fixed header
+        for size in (self.sizes[-1] - 1, self.sizes[-2] + 100,
+                     self.sizes[-2] + 5):
+            with self.subTest(size=size):
+                with open(self.path, "r+b") as file:
+                    file.truncate(size)
+
+                people = [header["person"]
+                          for header, values in export.read(self.path)]
+                self.assertEqual(people, [person for person, _, _ in
+                                          PEOPLE[:-1]])
+
+    def test_not_a_dataset(self):
+        with open("not_a_dataset", "wb") as file:
+            file.write(b"x" * 100)
+
+        with self.assertRaises(ValueError):
+            list(export.read("not_a_dataset"))
+
+    @unittest.skipIf(export.pyarrow is None, "PyArrow isn't installed")
+    def test_to_arrow(self):
+        table = export.to_arrow(self.path, ("rs_id", "result"))
+
+        self.assertEqual(table.num_rows, 3 * len(self._expected("Alice")
+                                                 ["rs_id"]))
+        self.assertEqual(table.column("person").to_pylist()[0], "Alice")
+
+
+if __name__ == '__main__':
+    unittest.main()
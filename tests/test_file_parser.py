@@ -0,0 +1,180 @@
+"""
+
+File parser tests
+Parses small synthetic DNA files, plain and compressed, through every
+backend and the genotype cache
+
+"""
+
+import bz2
+import gzip
+import os
+import subprocess
+import sys
+import unittest
+import zipfile
+from unittest import mock
+
+import file_parser
+from gene import Gene
+from tests.helpers import WorkingDirectoryTest, write_dna_file
+
+LINES = 2000
+
+
+def _compress(path, compression):
+    """
+    Writes a compressed copy of the file
+
+    :return:
+    Path of the copy
+    """
+
+    with open(path, "rb") as file:
+        data = file.read()
+
+    if compression == "zip":
+        with zipfile.ZipFile(f"{path}.zip", "w", zipfile.ZIP_DEFLATED) as zip:
+            zip.writestr(os.path.basename(path), data)
+    else:
+        opener = gzip.open if compression == "gz" else bz2.open
+        with opener(f"{path}.{compression}", "wb") as file:
+            file.write(data)
+
+    return f"{path}.{compression}"
+
+
+class FileParserTest(WorkingDirectoryTest):
+
+    def setUp(self):
+        super().setUp()
+
+        self.dna_path = "dna.txt"
+        write_dna_file(self.dna_path, LINES)
+
+        self.groups = {"Test": [Gene([f"Gene{i}", f"rs{i}", "A", "G", "A",
+                                      "G", "Red", "Yellow", "Green"])
+                                for i in (1, 50, 999, LINES, LINES + 1)]}
+        self.expected = file_parser.parse(self.groups, self.dna_path,
+                                          "AncestryDNA")
+
+    def test_pulls_panel_genes(self):
+        self.assertEqual(sorted(self.expected),
+                         sorted(["rs1", "rs50", "rs999", f"rs{LINES}"]))
+        self.assertEqual(self.expected["rs50"], ["1", "5000", "G", "G"])
+
+    def test_compressed_files_match(self):
+        for compression in ("gz", "bz2", "zip"):
+            path = _compress(self.dna_path, compression)
+
+            for backend in ("stream", "mmap"):
+                with self.subTest(compression=compression, backend=backend):
+                    self.assertEqual(file_parser.parse(self.groups, path,
+                                                       backend=backend),
+                                     self.expected)
+
+    def test_cache_build_pass(self):
+        # The pass building the cache reads the whole file and must leave it
+        # open to the end, it used to close it before the stats were taken
+        for path in (self.dna_path, _compress(self.dna_path, "gz")):
+            with self.subTest(path=path):
+                stats = {}
+                self.assertEqual(file_parser.parse(self.groups, path,
+                                                   "AncestryDNA", stats=stats,
+                                                   use_cache=True),
+                                 self.expected)
+                self.assertEqual(stats["bytes_read"],
+                                 os.path.getsize(path))
+
+                # Served from the cache the second time
+                self.assertEqual(file_parser.parse(self.groups, path,
+                                                   "AncestryDNA",
+                                                   use_cache=True),
+                                 self.expected)
+
+    def test_shared_handle_stays_open(self):
+        with file_parser.DnaFile(self.dna_path) as dna_file:
+            for use_cache in (True, False):
+                self.assertEqual(file_parser.parse(self.groups, dna_file,
+                                                   use_cache=use_cache),
+                                 self.expected)
+
+    def test_parse_many_matches_parse(self):
+        # Overlapping, disjoint, missing only and empty sets of groups
+        genes = self.groups["Test"]
+        group_sets = {"all": self.groups,
+                      "overlap": {"A": genes[:2], "B": genes[1:3]},
+                      "last": {"C": genes[3:]},
+                      "missing": {"D": genes[4:]},
+                      "empty": {}}
+
+        for path in (self.dna_path, _compress(self.dna_path, "gz")):
+            for backend in ("stream", "mmap"):
+                for use_cache in (False, True):
+                    with self.subTest(path=path, backend=backend,
+                                      use_cache=use_cache):
+
+                        # One scan for every set
+                        with mock.patch.object(
+                                file_parser, "_pull_genes",
+                                wraps=file_parser._pull_genes) as pull:
+                            many = file_parser.parse_many(
+                                group_sets, path, backend=backend,
+                                use_cache=use_cache)
+                        pull.assert_called_once()
+
+                        self.assertEqual(
+                            many, {name: file_parser.parse(groups, path,
+                                                           backend=backend)
+                                   for name, groups in group_sets.items()})
+
+    def test_non_ascii_header(self):
+        # Run under the C locale, where text mode defaults to ASCII, so the
+        # cache and region passes must decode UTF-8 as the scanners do
+        with open(self.dna_path, "rb") as file:
+            data = file.read()
+
+        with open(self.dna_path, "wb") as file:
+            file.write("#Téléchargé – Zürich\n".encode() + data)
+
+        script = (
+            "import sys\n"
+            f"sys.path.insert(0, {os.path.abspath(self.working_dir)!r})\n"
+            "import file_parser\n"
+            "wanted = {'Test': []}\n"
+            f"lookup = {set(self.expected)!r}\n"
+            "for use_cache in (False, True, True):\n"
+            "    print(sorted(file_parser.parse(None, 'dna.txt', "
+            "'AncestryDNA', lookup=lookup, use_cache=use_cache).items()))\n"
+            "for _ in range(2):\n"
+            "    print(sorted(file_parser.parse_regions("
+            "'dna.txt', [('1', 4900, 5100)], 'AncestryDNA')))\n")
+
+        environment = dict(os.environ, LC_ALL="C", PYTHONCOERCECLOCALE="0",
+                           PYTHONUTF8="0")
+        result = subprocess.run([sys.executable, "-X", "utf8=0", "-c",
+                                 script], env=environment,
+                                capture_output=True, text=True)
+
+        self.assertEqual(result.returncode, 0, result.stderr)
+
+        lines = result.stdout.splitlines()
+        self.assertEqual(lines[:3], [str(sorted(self.expected.items()))] * 3)
+        self.assertEqual(lines[3:], [str([f"rs{i}" for i in range(49, 52)])]
+                         * 2)
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            file_parser.parse(self.groups, self.dna_path, "AncestryDNA",
+                              backend="regex")
+
+    def test_invalid_file(self):
+        with open("invalid.txt", "w") as file:
+            file.write("not a DNA file\n")
+
+        with self.assertRaises(ValueError):
+            file_parser.parse(self.groups, "invalid.txt")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+"""
+
+Genotype cache tests
+Indexes synthetic DNA files, from one process and several at once
+
+"""
+
+import json
+import multiprocessing
+import os
+import unittest
+
+import genotype_cache
+from tests.helpers import (BASES, WorkingDirectoryTest, dna_rows,
+                           write_dna_file)
+
+FILES = 12
+LINES = 500
+
+
+def _write_dna_file(path, seed):
+    """
+    Writes a DNA file, different for each seed
+
+    :return:
+    Its rows, as store() takes them
+    """
+
+    def genotype(i):
+        return BASES[(i + seed) % 4], "A"
+
+    write_dna_file(path, LINES, genotype=genotype)
+
+    return list(dna_rows(LINES, genotype=genotype))
+
+
+def _store(job):
+    """
+    Indexes a DNA file, run in a worker process
+    """
+
+    dna_path, seed = job
+    genotype_cache.store(dna_path, _write_dna_file(dna_path, seed))
+
+
+class GenotypeCacheTest(WorkingDirectoryTest):
+
+    def _indexes(self):
+        with open(genotype_cache.MANIFEST) as file:
+            manifest = json.load(file)
+
+        files = {name[:-len(".db")]
+                 for name in os.listdir(genotype_cache.CACHE_DIR)
+                 if name.endswith(".db")}
+
+        return manifest, files
+
+    def test_store_and_fetch(self):
+        rows = _write_dna_file("dna.txt", 0)
+        self.assertIsNone(genotype_cache.fetch("dna.txt", {"rs1"}))
+
+        genotype_cache.store("dna.txt", rows)
+
+        self.assertEqual(genotype_cache.fetch("dna.txt", {"rs2", "rs0"}),
+                         {"rs2": ["1", "200", "G", "A"]})
+
+    def test_concurrent_stores(self):
+        jobs = [(f"dna{seed}.txt", seed) for seed in range(FILES)]
+
+        with multiprocessing.Pool(6) as pool:
+            pool.map(_store, jobs, chunksize=1)
+
+        manifest, files = self._indexes()
+
+        # Each distinct file is recorded, with its path, and found again
+        self.assertEqual(set(manifest["indexes"]), files)
+        self.assertEqual(len(manifest["paths"]), FILES)
+
+        for dna_path, seed in jobs:
+            self.assertIsNotNone(genotype_cache.fetch(dna_path, {"rs1"}))
+
+    def test_eviction(self):
+        for seed in range(3):
+            _store((f"dna{seed}.txt", seed))
+
+        size = max(entry["size"] for entry
+                   in self._indexes()[0]["indexes"].values())
+
+        # Room for two, the least recently used goes
+        genotype_cache.fetch("dna0.txt", {"rs1"})
+        rows = _write_dna_file("dna3.txt", 3)
+        genotype_cache.store("dna3.txt", rows, max_bytes=size * 2)
+
+        self.assertIsNone(genotype_cache.fetch("dna1.txt", {"rs1"}))
+        self.assertIsNotNone(genotype_cache.fetch("dna0.txt", {"rs1"}))
+        self.assertEqual(len(self._indexes()[1]), 2)
+
+    def test_unrecorded_index_is_evicted(self):
+        _store(("dna0.txt", 0))
+
+        with open(f"{genotype_cache.CACHE_DIR}/{'0' * 40}.db", "wb") as file:
+            file.write(b"\0" * 4096)
+
+        genotype_cache.clear()
+
+        self.assertEqual(self._indexes()[1], set())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,231 @@
+"""
+
+Group manager tests
+Migrates groups from the old pickle file, checks that every change to the
+group database survives a reload, and that GeneGroup's indexes stay in
+sync with its genes
+
+"""
+
+import _pickle as pickle
+import os
+import random
+import sqlite3
+import unittest
+from unittest import mock
+
+import gene
+import group_mngr
+from gene import Gene
+from tests.helpers import WorkingDirectoryTest
+
+
+def _gene(name, rs_id=None):
+    return Gene([name, rs_id or f"rs{name}", "A", "G", "A", "G",
+                 f"{name} red", "Yellow", "Green"])
+
+
+def _attributes(groups):
+    """
+    Groups as {'Group Name': [[attribute, ], ], }, in order, to compare
+    """
+
+    return [(name, [_gene.get_attributes() for _gene in genes])
+            for name, genes in groups.items()]
+
+
+class _OldGene:
+    """
+    Gene as pickled before __slots__, its state is its __dict__
+    """
+
+    def __init__(self, _gene):
+        self.__dict__.update(_gene.__getstate__())
+
+
+_OldGene.__module__ = "gene"
+_OldGene.__qualname__ = "Gene"
+
+
+class GroupStoreTest(WorkingDirectoryTest):
+
+    def setUp(self):
+        super().setUp()
+
+        self.groups = {"Vitamins": [_gene("VDR"), _gene("MTHFR"),
+                                    _gene("FUT2")],
+                       "Cardio": [_gene("APOE", "rs429358"), _gene("LPA")],
+                       "Empty": []}
+
+    def _migrate(self, groups):
+        self._pickle(groups)
+        group_mngr._make_paths()
+
+    def _pickle(self, groups):
+        os.makedirs("PersistentData")
+
+        with open(group_mngr.PICKLE_PATH, "wb") as file_object:
+            pickle.dump(groups, file_object)
+
+    def test_migrates_pickle(self):
+        self._migrate(self.groups)
+
+        groups = group_mngr.load_groups()
+        self.assertEqual(_attributes(groups), _attributes(self.groups))
+        self.assertIsInstance(groups["Vitamins"], group_mngr.GeneGroup)
+        self.assertIs(groups["Cardio"].find_rs_id("rs429358"),
+                      groups["Cardio"][0])
+
+    def test_migrates_genes_pickled_before_slots(self):
+        old_groups = {name: [_OldGene(_gene) for _gene in genes]
+                      for name, genes in self.groups.items()}
+
+        with mock.patch.object(gene, "Gene", _OldGene):
+            self._pickle(old_groups)
+
+        group_mngr._make_paths()
+        self.assertEqual(_attributes(group_mngr.load_groups()),
+                         _attributes(self.groups))
+
+    def test_migrates_once(self):
+        self._migrate(self.groups)
+        group_mngr.delete_group("Cardio")
+
+        # The pickle is left behind but never read again
+        group_mngr._make_paths()
+        self.assertEqual(list(group_mngr.load_groups()), ["Vitamins", "Empty"])
+
+    def test_interrupted_migration_starts_over(self):
+        with mock.patch.object(group_mngr, "_write_groups",
+                               side_effect=sqlite3.OperationalError):
+            with self.assertRaises(sqlite3.OperationalError):
+                self._migrate(self.groups)
+
+        group_mngr._make_paths()
+        self.assertEqual(_attributes(group_mngr.load_groups()),
+                         _attributes(self.groups))
+
+    def test_without_pickle(self):
+        group_mngr._make_paths()
+        self.assertEqual(group_mngr.load_groups(), {})
+
+    def test_changes_persist(self):
+        group_mngr._make_paths()
+        group_mngr.save_groups(self.groups)
+        self.assertEqual(_attributes(group_mngr.load_groups()),
+                         _attributes(self.groups))
+
+        group_mngr.add_group("Lipids")
+        group_mngr.add_gene("Lipids", _gene("CETP"))
+        group_mngr.add_gene("Empty", _gene("COMT"))
+
+        # Renamed and given a new RS id, in place
+        group_mngr.update_gene("Vitamins", "MTHFR", _gene("MTR", "rs1805087"))
+        group_mngr.delete_gene("Vitamins", "VDR")
+        group_mngr.delete_group("Cardio")
+
+        self.groups["Lipids"] = [_gene("CETP")]
+        self.groups["Empty"].append(_gene("COMT"))
+        self.groups["Vitamins"] = [_gene("MTR", "rs1805087"), _gene("FUT2")]
+        del self.groups["Cardio"]
+
+        self.assertEqual(_attributes(group_mngr.load_groups()),
+                         _attributes(self.groups))
+
+        # save_groups() replaces everything
+        group_mngr.save_groups({"Cardio": [_gene("LPA")]})
+        self.assertEqual(_attributes(group_mngr.load_groups()),
+                         [("Cardio", [_gene("LPA").get_attributes()])])
+
+    def test_duplicate_names(self):
+        # Edits go to the first gene with the name, as GeneGroup.find()
+        group_mngr._make_paths()
+        group_mngr.save_groups({"Test": [_gene("A", "rs1"), _gene("A", "rs2"),
+                                         _gene("A", "rs3")]})
+
+        group_mngr.update_gene("Test", "A", _gene("B", "rs1"))
+        group_mngr.delete_gene("Test", "A")
+
+        self.assertEqual([_gene.rs_id for _gene in
+                          group_mngr.load_groups()["Test"]], ["rs1", "rs3"])
+
+
+class GeneGroupTest(unittest.TestCase):
+
+    def setUp(self):
+        self.group = group_mngr.GeneGroup([_gene("VDR"), _gene("MTHFR"),
+                                           _gene("FUT2")])
+
+    def _assert_in_sync(self):
+        # The indexes match those built from scratch
+        rebuilt = group_mngr.GeneGroup(self.group)
+        self.assertEqual(self.group._by_name, rebuilt._by_name)
+        self.assertEqual(self.group._by_rs_id, rebuilt._by_rs_id)
+
+    def test_find(self):
+        self.assertIs(self.group.find("MTHFR"), self.group[1])
+        self.assertIs(self.group.find_rs_id("rsFUT2"), self.group[2])
+        self.assertIsNone(self.group.find("APOE"))
+        self.assertIsNone(self.group.find_rs_id("rs429358"))
+
+    def test_add(self):
+        self.group.add(_gene("APOE", "rs429358"))
+
+        self.assertIs(self.group.find("APOE"), self.group[-1])
+        self.assertIs(self.group.find_rs_id("rs429358"), self.group[-1])
+        self._assert_in_sync()
+
+    def test_delete(self):
+        deleted = self.group.delete("MTHFR")
+
+        self.assertEqual(deleted.name, "MTHFR")
+        self.assertNotIn(deleted, self.group)
+        self.assertIsNone(self.group.find("MTHFR"))
+        self.assertIsNone(self.group.find_rs_id("rsMTHFR"))
+        self.assertIsNone(self.group.delete("MTHFR"))
+        self._assert_in_sync()
+
+    def test_update(self):
+        updated = self.group.update("MTHFR",
+                                    _gene("MTR", "rs1805087").get_attributes())
+
+        self.assertIs(updated, self.group[1])
+        self.assertIs(self.group.find("MTR"), updated)
+        self.assertIs(self.group.find_rs_id("rs1805087"), updated)
+        self.assertIsNone(self.group.find("MTHFR"))
+        self.assertIsNone(self.group.find_rs_id("rsMTHFR"))
+        self.assertIsNone(self.group.update("MTHFR",
+                                            _gene("MTR").get_attributes()))
+        self._assert_in_sync()
+
+    def test_update_keeps_group_order(self):
+        # Renamed to a later gene's name, it's found first as it's first in
+        # the group
+        self.group.update("VDR", _gene("FUT2").get_attributes())
+
+        self.assertIs(self.group.find("FUT2"), self.group[0])
+        self.assertIs(self.group.find_rs_id("rsFUT2"), self.group[0])
+        self._assert_in_sync()
+
+    def test_random_edits(self):
+        # Names and RS ids drawn from a few so duplicates are common
+        shuffle = random.Random(0)
+
+        for _ in range(2000):
+            name = shuffle.choice("ABCDE")
+            rs_id = shuffle.choice(["rs1", "rs2", "rs3"])
+            action = shuffle.choice(["add", "update", "delete"])
+
+            if action == "add":
+                self.group.add(_gene(name, rs_id))
+            elif action == "update":
+                self.group.update(shuffle.choice("ABCDE"),
+                                  _gene(name, rs_id).get_attributes())
+            else:
+                self.group.delete(name)
+
+            self._assert_in_sync()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+"""
+
+Logger tests
+Writes records through the queue and writer thread, rotates logs, and
+checks that failing writes neither raise nor stop the writer
+
+"""
+
+import json
+import multiprocessing
+import os
+import queue
+import threading
+import unittest
+from unittest import mock
+
+import logger
+from tests.helpers import WorkingDirectoryTest
+
+
+def _read_records(path):
+    with open(path) as file:
+        return [json.loads(line) for line in file]
+
+
+def _log_many(path, count):
+    log = logger._Log(path)
+
+    for i in range(count):
+        log.write({"pid": os.getpid(), "number": i})
+
+    log.flush()
+
+
+class LoggerTest(WorkingDirectoryTest):
+
+    def setUp(self):
+        super().setUp()
+        self.path = "PersistentData/log.txt"
+        self.log = logger._Log(self.path)
+
+    def _flush(self):
+        # A writer thread that died leaves flush() waiting forever
+        flusher = threading.Thread(target=self.log.flush, daemon=True)
+        flusher.start()
+        flusher.join(10)
+        self.assertFalse(flusher.is_alive(), "flush() never returned")
+
+    def test_writes_json_lines(self):
+        for i in range(100):
+            self.log.write({"number": i, "when": self})
+        self._flush()
+
+        records = _read_records(self.path)
+        self.assertEqual([record["number"] for record in records],
+                         list(range(100)))
+        self.assertEqual(records[0]["when"], str(self))
+
+    def test_module_log(self):
+        with mock.patch.object(logger, "LOG_PATH", self.path):
+            logger.log("Hello", rs_id="rs1")
+            logger.flush()
+
+        record = _read_records(self.path)[-1]
+        self.assertEqual(record["message"], "Hello")
+        self.assertEqual(record["rs_id"], "rs1")
+        self.assertEqual(record["pid"], os.getpid())
+
+    def test_rotates(self):
+        with mock.patch.object(logger, "MAX_BYTES", 200):
+            for i in range(100):
+                self.log.write({"number": i})
+                self._flush()
+
+        backups = [f"{self.path}.{number}"
+                   for number in range(1, logger.BACKUP_COUNT + 1)]
+        for path in [self.path] + backups:
+            self.assertLessEqual(os.path.getsize(path), 200)
+        self.assertFalse(os.path.exists(
+            f"{self.path}.{logger.BACKUP_COUNT + 1}"))
+
+        # The newest records are kept, oldest in the last backup
+        records = []
+        for path in reversed([self.path] + backups):
+            records += _read_records(path)
+        numbers = [record["number"] for record in records]
+        self.assertEqual(numbers, list(range(100 - len(numbers), 100)))
+
+    def test_writer_survives_errors(self):
+        write = self.log._write
+
+        with mock.patch.object(self.log, "_write",
+                               side_effect=ValueError("Bad write")):
+            self.log.write({"number": 0})
+            self._flush()
+
+        with mock.patch.object(self.log, "_write", side_effect=write):
+            self.log.write({"number": 1})
+            self._flush()
+
+        self.assertEqual(_read_records(self.path), [{"number": 1}])
+
+    def test_full_queue_write_errors(self):
+        # The writer is behind and the caller's own write fails
+        self.log._pid = os.getpid()
+        self.log._queue = queue.Queue(1)
+        self.log._queue.put_nowait("")
+
+        with mock.patch.object(self.log, "_write",
+                               side_effect=OSError("Disk full")) as write:
+            self.log.write({"number": 0})
+
+        write.assert_called_once()
+
+    def test_processes_share_a_log(self):
+        context = multiprocessing.get_context("spawn")
+        processes = [context.Process(target=_log_many, args=(self.path, 500))
+                     for _ in range(4)]
+
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+            self.assertEqual(process.exitcode, 0)
+
+        records = _read_records(self.path)
+        self.assertEqual(len(records), 2000)
+
+        for process in processes:
+            self.assertEqual([record["number"] for record in records
+                              if record["pid"] == process.pid],
+                             list(range(500)))
+
+
+if __name__ == '__main__':
+    unittest.main()
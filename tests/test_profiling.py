@@ -0,0 +1,88 @@
+"""
+
+Profiling tests
+Stage timings, nested stages and the stages a report records
+
+"""
+
+import os
+import time
+import unittest
+
+import profiling
+from gene import Gene
+from tests.helpers import WorkingDirectoryTest
+
+try:
+    from PIL import Image
+except ImportError:  # Comes with ReportLab's image support
+    Image = None
+
+
+class ProfilerTest(WorkingDirectoryTest):
+
+    def setUp(self):
+        super().setUp()
+
+        self.profiler = profiling.Profiler()
+        self.profiler.start()
+        self.addCleanup(self.profiler.stop)
+
+    def test_repeated_stage(self):
+        for _ in range(3):
+            with self.profiler.stage("format"):
+                time.sleep(0.01)
+
+        stage = self.profiler.stages["format"]
+        self.assertEqual(stage["calls"], 3)
+        self.assertGreaterEqual(stage["wall_seconds"], 0.03)
+
+    def test_nested_stage_time_counts_once(self):
+        with self.profiler.stage("build"):
+            time.sleep(0.02)
+
+            with self.profiler.stage("format"):
+                time.sleep(0.1)
+                memory = bytearray(1 << 20)
+                del memory
+
+        build = self.profiler.stages["build"]
+        format_ = self.profiler.stages["format"]
+
+        self.assertGreaterEqual(format_["wall_seconds"], 0.1)
+        self.assertGreaterEqual(build["wall_seconds"], 0.02)
+        self.assertLess(build["wall_seconds"], 0.08)
+
+        # The inner stage's allocations are part of the outer one's peak
+        self.assertGreaterEqual(format_["peak_memory_bytes"], 1 << 20)
+        self.assertGreaterEqual(build["peak_memory_bytes"], 1 << 20)
+
+
+@unittest.skipIf(Image is None, "Pillow isn't installed")
+class ReportStagesTest(WorkingDirectoryTest):
+
+    def test_streamed_report_times_format(self):
+        import generate_pdf
+
+        os.makedirs("PersistentData")
+        Image.new("RGB", (64, 64)).save(generate_pdf.LOGO_PATH)
+
+        genes = [Gene([f"Gene{i}", f"rs{i}", "A", "G", "A", "G", "Red",
+                       "Yellow", "Green"]) for i in range(250)]
+        pulled_genes = {f"rs{i}": ["1", str(i), "A", "G"] for i in range(250)}
+
+        for stream in (True, False):
+            with self.subTest(stream=stream):
+                profiler = profiling.Profiler()
+                generate_pdf.write_report({"Test": genes}, pulled_genes,
+                                          "report", ".", "AncestryDNA", "",
+                                          profiler=profiler, stream=stream)
+
+                self.assertEqual(set(profiler.stages),
+                                 {"classify", "format", "build"})
+                self.assertEqual(profiler.stages["format"]["calls"],
+                                 -(-len(genes) // generate_pdf.TABLE_ROWS))
+
+
+if __name__ == '__main__':
+    unittest.main()
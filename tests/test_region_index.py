@@ -0,0 +1,113 @@
+"""
+
+Region index tests
+Region queries against a full scan, and when indexes are replaced or
+deleted
+
+"""
+
+import os
+import unittest
+from unittest import mock
+
+import file_parser
+import genotype_cache
+import region_index
+from gene import Gene
+from tests.helpers import WorkingDirectoryTest, write_dna_file
+
+LINES = 3000
+
+
+def _write_dna_file(path, lines=LINES, allele="A"):
+    """
+    Writes a DNA file over three chromosomes, its first alleles all allele
+    """
+
+    write_dna_file(path, lines, chromosomes=3, spacing=10,
+                   genotype=lambda i: (allele, "G"))
+
+
+def _index_files():
+    return [name for name in os.listdir(region_index.INDEX_DIR)
+            if name.endswith(".idx")]
+
+
+class RegionIndexTest(WorkingDirectoryTest):
+
+    regions = [("1", 95, 2000), ("2", 10005, 10500), ("3", 29990, 40000),
+               ("X", 1, 100)]
+
+    def setUp(self):
+        super().setUp()
+        _write_dna_file("dna.txt")
+
+    def _expected(self, dna_path):
+        genes = {}
+
+        with file_parser.DnaFile(dna_path) as dna_file:
+            for row in file_parser._rows(dna_file,
+                                         lambda row: (row[0], row[1:])):
+                if file_parser._in_regions(row, self.regions):
+                    genes[row[0]] = row[1:]
+
+        return genes
+
+    def test_regions(self):
+        expected = self._expected("dna.txt")
+
+        # Built by the first query, used by the second
+        self.assertIsNone(region_index.load("dna.txt"))
+        self.assertEqual(file_parser.parse_regions("dna.txt", self.regions),
+                         expected)
+        self.assertIsNotNone(region_index.load("dna.txt"))
+        self.assertEqual(file_parser.parse_regions("dna.txt", self.regions),
+                         expected)
+
+    def test_changed_file_replaces_index(self):
+        file_parser.parse_regions("dna.txt", self.regions)
+
+        _write_dna_file("dna.txt", LINES + 500, allele="C")
+        os.utime("dna.txt", ns=(0, 10 ** 18))
+        self.assertIsNone(region_index.load("dna.txt"))
+
+        self.assertEqual(file_parser.parse_regions("dna.txt", self.regions),
+                         self._expected("dna.txt"))
+        self.assertEqual(len(_index_files()), 1)
+
+    def test_removed_with_cache_index(self):
+        groups = {"Test": [Gene(["Gene", "rs1", "A", "G", "A", "G", "Red",
+                                 "Yellow", "Green"])]}
+
+        for name in ("dna.txt", "other.txt"):
+            _write_dna_file(name, allele="A" if name == "dna.txt" else "T")
+            file_parser.parse(groups, name, use_cache=True)
+
+        self.assertEqual(len(_index_files()), 2)
+
+        genotype_cache.clear()
+
+        self.assertEqual(_index_files(), [])
+
+    def test_size_cap(self):
+        for i in range(4):
+            _write_dna_file(f"dna{i}.txt")
+            file_parser.parse_regions(f"dna{i}.txt", self.regions)
+
+            # Each newer than the last, whatever the clock's resolution
+            os.utime(region_index._index_path(f"dna{i}.txt"), (i, i))
+
+        size = os.path.getsize(region_index._index_path("dna0.txt"))
+
+        with mock.patch.object(region_index, "MAX_INDEX_BYTES", size * 2):
+            region_index.load("dna1.txt")  # Now the most recently used
+            _write_dna_file("dna4.txt")
+            file_parser.parse_regions("dna4.txt", self.regions)
+
+        kept = [name for name in range(5)
+                if region_index.load(f"dna{name}.txt") is not None]
+        self.assertEqual(kept, [1, 4])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+"""
+
+Workers tests
+Collects DNA files from directories, shares a value with pool workers, and
+checks the cohort run stays free of the report code
+
+"""
+
+import os
+import subprocess
+import sys
+import unittest
+
+import workers
+from tests.helpers import WorkingDirectoryTest
+
+
+def _shared(number):
+    return number, workers.shared()
+
+
+class WorkersTest(WorkingDirectoryTest):
+
+    def test_collect_dna_files(self):
+        os.makedirs(os.path.join("files", "nested"))
+
+        for name in ("b.txt", "a.bz2", "c.txt.gz", "d.zip", "e.pdf",
+                     os.path.join("nested", "f.txt")):
+            with open(os.path.join("files", name), "w"):
+                pass
+
+        self.assertEqual(workers.collect_dna_files(["files", "z.txt"]),
+                         sorted([os.path.join("files", name) for name in
+                                 ("a.bz2", "b.txt", "c.txt.gz", "d.zip")] +
+                                ["z.txt"]))
+
+    def test_shares_value(self):
+        shared = {"Test": list(range(100))}
+
+        with workers.make_pool(2, shared) as pool:
+            results = sorted(pool.imap_unordered(_shared, range(10)))
+
+        self.assertEqual(results, [(number, shared) for number in range(10)])
+
+    def test_cohort_skips_reportlab(self):
+        script = ("import sys\n"
+                  f"sys.path.insert(0, {os.path.abspath(self.working_dir)!r})\n"
+                  "import cohort\n"
+                  "print(sorted({'batch', 'generate_pdf', 'reportlab'} & "
+                  "set(sys.modules)))\n")
+
+        result = subprocess.run([sys.executable, "-c", script],
+                                capture_output=True, text=True)
+
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.strip(), "[]")
+
+
+if __name__ == '__main__':
+    unittest.main()
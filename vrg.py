@@ -7,6 +7,7 @@ GUI file
 """
 
 from kivy.app import App
+from kivy.clock import Clock
 
 from kivy.core.window import Window
 from kivy.uix.screenmanager import ScreenManager, Screen, NoTransition
@@ -27,10 +28,12 @@ from kivy.uix.progressbar import ProgressBar
 # Modules:
 from os import path, startfile
 from configparser import ConfigParser
+import threading
 # My files:
 import group_mngr
 from gene import Gene
 import generate_pdf
+import file_parser
 from logger import log
 
 config = ConfigParser()
@@ -120,6 +123,27 @@ class GlobalData:
         self.save_settings(config)
 
 
+class ScheduledProgress:
+    """
+    Progress sink for generate_pdf.generate on a worker thread. Widgets may
+    only be changed from the Kivy thread, so each update is scheduled onto
+    it.
+    """
+
+    def __init__(self, bar):
+        self.bar = bar
+        self._value = 0
+
+    @property
+    def value(self):
+        return self._value
+
+    @value.setter
+    def value(self, value):
+        self._value = value
+        Clock.schedule_once(lambda dt: setattr(self.bar, 'value', value))
+
+
 class HomeButton(ButtonBehavior, Image):
     """An image that switches back to home (menu) screen."""
 
@@ -301,8 +325,8 @@ class GroupScreen(Screen):
 
             log(f"Group {active_group} deleted.")
 
-            # Overwrite the existing groups with the modified group dictionary
-            group_mngr.save_groups(global_data.groups)
+            # Delete it from the saved groups
+            group_mngr.delete_group(active_group)
 
             # Clear the selected group
             global_data.active_group = ''
@@ -416,8 +440,9 @@ class NewGroupScreen(Screen):
                 group_name.strip() != '':
             self.name_ti.text = ''  # Clear input
             global_data.active_group = group_name  # Set group name as active
-            global_data.groups[group_name] = []  # Add new group to group dict
-            group_mngr.save_groups(global_data.groups)  # Save group dictionary
+            # Add new group to group dict
+            global_data.groups[group_name] = group_mngr.GeneGroup()
+            group_mngr.add_group(group_name)  # Save the new group
             log(f"Group {group_name} created.")
             sm.current = 'editgene'  # Switch screens
 
@@ -477,7 +502,7 @@ class GeneScreen(Screen):
         # *Drop Down Menu------------------------------------------------------
         self.dropdown = DropDown()
         self.dropdown.bind(on_select=self.set_gene)
-        self.dd_btns = []  # A list of drop down buttons for easy deletion
+        self.dd_btns = {}  # Drop down buttons by gene name for easy deletion
 
         #       Populate when top button hit
         self.mainbutton = CustomButton(text='Select a gene',
@@ -522,7 +547,7 @@ class GeneScreen(Screen):
         """Called when drop down is opened"""
 
         self.dropdown.clear_widgets()  # Clear any packaged buttons
-        del self.dd_btns[:]  # Clear drop down button list
+        self.dd_btns.clear()  # Clear drop down button list
 
         # Grab relevant genes
         genes = global_data.groups[global_data.active_group]
@@ -535,7 +560,7 @@ class GeneScreen(Screen):
             btn.bind(on_release=lambda button:
                      self.dropdown.select(button.text))
             self.dropdown.add_widget(btn)  # Add button to menu
-            self.dd_btns.append(btn)  # Store button in delety-list
+            self.dd_btns[gene.name] = btn  # Store button in delety-list
 
         self.dropdown.open(args[0])
 
@@ -549,19 +574,12 @@ class GeneScreen(Screen):
             group = global_data.active_group  # Get active group
             gene = global_data.active_gene  # Get active gene
 
-            # Iterate through genes because we need to check the name of each
-            for index, _gene in enumerate(global_data.groups[group]):
-
-                if _gene.name == gene:
-
-                    # Delete the gene
-                    del global_data.groups[group][index]
-                    # Remove from drop down
-                    self.dropdown.remove_widget(self.dd_btns[index])
-                    log(f"Gene {gene} deleted.")
-                    break
-
-            group_mngr.save_groups(global_data.groups)  # Save the groups
+            # Delete the gene
+            if global_data.groups[group].delete(gene) is not None:
+                group_mngr.delete_gene(group, gene)
+                # Remove from drop down
+                self.dropdown.remove_widget(self.dd_btns.pop(gene))
+                log(f"Gene {gene} deleted.")
 
             global_data.active_gene = ''  # No active gene
             self.dropdown.select('Select a gene')
@@ -701,25 +719,23 @@ class EditGeneScreen(Screen):
 
             if active_gene:
 
-                for index, _gene in enumerate(
-                        global_data.groups[active_group]):
+                gene_obj = global_data.groups[active_group].update(active_gene,
+                                                                   attributes)
 
-                    if _gene.name == active_gene:  # Gene object found
+                if gene_obj is not None:  # Gene object found
+                    group_mngr.update_gene(active_group, active_gene,
+                                           gene_obj)  # Save the changes
 
-                        gene_obj = global_data.groups[active_group][index]
-                        gene_obj.set_attributes(attributes)
-
-                        log(f"Gene {active_gene} updated.")
-
-                        break
+                    log(f"Gene {active_gene} updated.")
 
             else:
 
                 new_gene = Gene(attributes)  # Create new gene object
 
                 # Add it to the group
-                global_data.groups[global_data.active_group].append(new_gene)
-                group_mngr.save_groups(global_data.groups)  # Save group
+                global_data.groups[global_data.active_group].add(new_gene)
+                group_mngr.add_gene(global_data.active_group,
+                                    new_gene)  # Save gene
                 log(f"Gene {new_gene.name} saved.")
 
             sm.current = 'gene'  # Switch to gene selection
@@ -763,18 +779,15 @@ class EditGeneScreen(Screen):
 
         if active_gene:  # True if this is an edit
 
-            for index, _gene in enumerate(global_data.groups[active_group]):
-
-                if _gene.name == active_gene:  # Gene object found
+            gene_obj = global_data.groups[active_group].find(active_gene)
 
-                    gene_obj = global_data.groups[active_group][index]
-                    attributes = gene_obj.get_attributes()
+            if gene_obj is not None:  # Gene object found
 
-                    for i, entry in enumerate(self.entries):
+                attributes = gene_obj.get_attributes()
 
-                        entry.text = attributes[i]
+                for i, entry in enumerate(self.entries):
 
-                    break
+                    entry.text = attributes[i]
 
 
 class SetupScreen(Screen):
@@ -865,9 +878,20 @@ class SetupScreen(Screen):
 
         # Loading window
         self.loading_bar = ProgressBar(max=100)
+        self.cancel_event = None  # Set to stop the running report
+
+        loading_container = BoxLayout(orientation='vertical')
+        cancel_btn = CustomButton(text="Cancel",
+                                  size_hint=(1, .5))
+        cancel_btn.bind(on_release=self.cancel_report)
+        loading_container.add_widget(self.loading_bar)
+        loading_container.add_widget(cancel_btn)
+
+        # Only closed by the report finishing or being cancelled
         self.loading_popup = Popup(title='Generating...',
-                                   content=self.loading_bar,
-                                   size_hint=(1, .25))
+                                   content=loading_container,
+                                   size_hint=(1, .25),
+                                   auto_dismiss=False)
 
         # *Generate Button----------------------------------------------------*
         self.generate_btn = CustomButton(text="Generate and Open Report")
@@ -943,9 +967,11 @@ class SetupScreen(Screen):
                 self.file_chooser.path = default_dir
 
         else:  # If DNA path is selected
-            # Browse txt files
-            self.file_chooser = FileChooserListView(filters=['*.txt',
-                                                             self.is_dir])
+            # Browse DNA files, plain or compressed
+            self.file_chooser = FileChooserListView(
+                filters=[f"*{extension}"
+                         for extension in file_parser.DNA_EXTENSIONS] +
+                        [self.is_dir])
             # Check for default directory
             default_dir = config['Default Directories']['DNA Dir']
             if default_dir != '':
@@ -974,50 +1000,107 @@ class SetupScreen(Screen):
     def generate_report(self, *args):
         """
         Generates the report in PDF format using pre-made groups and given
-        DNA txt file.
+        DNA file, plain or compressed. The work runs on a background thread so the window
+        keeps responding, and reports back through Clock callbacks.
 
         Args:
             0 = Button object automatically passed.
         """
 
-        # self.loading_popup.open()
+        self.loading_bar.value = 0
+        self.cancel_event = threading.Event()
 
-        try:
-
-            doc = generate_pdf.generate(self.dna_path,
+        worker = threading.Thread(target=self._generate_worker,
+                                  args=(self.dna_path,
                                         self.header.text,
                                         self.filename.text,
                                         self.output_path,
-                                        self.loading_bar)
-
-            log(f"Report '{self.filename.text}' created in {self.output_path} "
-                f"from {self.dna_path}.")
+                                        self.cancel_event),
+                                  daemon=True)
+        worker.start()
 
-            self.loading_bar.value = 100
-            startfile(doc, 'open')
-            self.loading_popup.dismiss()
+    def _generate_worker(self, dna_path, header, filename, output_path,
+                         cancel):
+        """
+        Runs generate_pdf.generate on the worker thread. Widgets may only be
+        touched from the Kivy thread, so results are scheduled back onto it.
+        """
 
-            # Clear form
-            self.dna_path_lbl.text = ''
-            self.output_path_lbl.text = ''
-            self.filename.text = ''
-            self.header.text = ''
+        try:
+            doc = generate_pdf.generate(dna_path,
+                                        header,
+                                        filename,
+                                        output_path,
+                                        ScheduledProgress(self.loading_bar),
+                                        cancel=cancel)
 
-            # Switch screens
-            sm.current = 'menu'
+        except generate_pdf.ReportCancelled:
+            Clock.schedule_once(lambda dt: self.report_cancelled(filename))
 
         except ValueError as error:  # Called when invalid file is given
+            Clock.schedule_once(lambda dt, error=error:
+                                self.report_invalid(error))
+
+        except Exception as error:  # Anything else, don't leave popup open
+            Clock.schedule_once(lambda dt, error=error:
+                                self.report_failed(error))
+
+        else:
+            Clock.schedule_once(lambda dt: self.report_done(doc, filename,
+                                                            output_path,
+                                                            dna_path))
+
+    def cancel_report(self, *args):
+        """Asks the worker to stop at its next progress update."""
+
+        if self.cancel_event is not None:
+            self.cancel_event.set()
+
+    def report_done(self, doc, filename, output_path, dna_path):
+
+        log(f"Report '{filename}' created in {output_path} "
+            f"from {dna_path}.")
+
+        self.loading_bar.value = 100
+        startfile(doc, 'open')
+        self.loading_popup.dismiss()
+
+        # Clear form
+        self.dna_path_lbl.text = ''
+        self.output_path_lbl.text = ''
+        self.filename.text = ''
+        self.header.text = ''
+
+        # Switch screens
+        sm.current = 'menu'
+
+    def report_cancelled(self, filename):
+
+        log(f"Report '{filename}' cancelled.")
+        self.loading_popup.dismiss()
+
+    def report_invalid(self, error):
+
+        log(error)
+
+        warning_label = Label(text='File is not recognized as AncestryDNA'
+                                   ' or 23&Me file!')
+
+        warning = Popup(title='Error!',
+                        content=warning_label,
+                        size_hint=(1, .25))
+        self.loading_popup.dismiss()
+        warning.open()
 
-            log(error)
+    def report_failed(self, error):
 
-            warning_label = Label(text='File is not recognized as AncestryDNA'
-                                       ' or 23&Me file!')
+        log(f"Report failed: {error!r}")
 
-            warning = Popup(title='Error!',
-                            content=warning_label,
-                            size_hint=(1, .25))
-            self.loading_popup.dismiss()
-            warning.open()
+        warning = Popup(title='Error!',
+                        content=Label(text='The report could not be created.'),
+                        size_hint=(1, .25))
+        self.loading_popup.dismiss()
+        warning.open()
 
 
 global_data = GlobalData()
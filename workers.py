@@ -0,0 +1,85 @@
+"""
+
+Brandon Dunbar
+Workers
+Process pool helpers shared by batch.py and cohort.py
+
+Kept apart from the report code, so a cohort run and its workers never
+import generate_pdf or ReportLab.
+
+"""
+
+import multiprocessing
+import os
+
+import file_parser
+
+# Set in each worker process by _init_worker
+_shared = None
+
+
+def collect_dna_files(paths):
+    """
+    Expands a list of files and directories into the DNA files to process
+
+    :param paths:
+    DNA file paths and directories holding DNA files
+    :return:
+    A sorted list of DNA file paths
+    """
+
+    dna_paths = []
+
+    for path in paths:
+
+        if os.path.isdir(path):
+            for name in os.listdir(path):
+                file_path = os.path.join(path, name)
+                if os.path.isfile(file_path) and \
+                        name.endswith(file_parser.DNA_EXTENSIONS):
+                    dna_paths.append(file_path)
+
+        else:
+            dna_paths.append(path)
+
+    return sorted(dna_paths)
+
+
+def _init_worker(shared):
+    """
+    Runs once in each worker, so the shared value is sent to a worker once
+    rather than with every job
+
+    :param shared:
+    The value every job needs, e.g. the groups or panel
+    """
+
+    global _shared
+    _shared = shared
+
+
+def make_pool(processes, shared):
+    """
+    Starts a process pool whose workers read the shared value with shared()
+
+    :param processes:
+    Number of worker processes, defaults to the number of CPUs
+    :param shared:
+    The value every job needs, e.g. the groups or panel
+    :return:
+    A multiprocessing.Pool
+    """
+
+    return multiprocessing.Pool(processes, initializer=_init_worker,
+                                initargs=(shared,))
+
+
+def shared():
+    """
+    The value the pool was started with, in a worker process
+
+    :return:
+    The shared value
+    """
+
+    return _shared